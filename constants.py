@@ -9,6 +9,9 @@ SUBLIME_REGION_FLAGS = sublime.PERSISTENT | \
     sublime.DRAW_NO_OUTLINE
 
 RESET_STATUS_TIMEOUT = 6500
+VIEWPORT_POLL_INTERVAL = 250
+
+MODE_STATUS_KEY = "%s_mode" % PLUGIN_NAME
 
 LXML_NO_DTD_FOUND = "no DTD found"
 XML_MODEL = "xml-model"
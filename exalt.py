@@ -1,4 +1,5 @@
 import os
+import time
 
 from os.path import expanduser
 from urllib.request import pathname2url
@@ -9,6 +10,10 @@ import sublime
 import sublime_plugin
 
 import Exalt.constants as constants
+import Exalt.messages as messages
+import Exalt.settings as settings
+
+import Exalt.impl.associations as associations
 
 
 class LimitedOrderedDict(OrderedDict):
@@ -30,8 +35,20 @@ class LimitedOrderedDict(OrderedDict):
                 self.popitem(last=False)
 
 
-parser_cache = LimitedOrderedDict(max_size=10)
-error_point = 0
+# The parser cache holds both compiled schemas and their content models.
+parser_cache = LimitedOrderedDict(max_size=20)
+document_cache = LimitedOrderedDict(max_size=10)
+include_cache = LimitedOrderedDict(max_size=1000)
+xpath_cache = LimitedOrderedDict(max_size=100)
+xslt_cache = LimitedOrderedDict(max_size=20)
+startup_report = OrderedDict()
+plugin_loaded_at = None
+error_indexes = {}
+linters = {}
+# The (change count, Outline) of each view whose outline a command has used.
+outlines = {}
+content_models = {}
+association_index = associations.AssociationIndex([])
 
 
 def get_plugin_path():
@@ -66,9 +83,43 @@ def get_catalog_files(setting):
     return env.union(catalog_urls)
 
 
+def measure(label, function, *args):
+    """Call function with args and add the time it took to the startup
+    report.
+
+    Only the first call with a given label is recorded."""
+    start = time.perf_counter()
+
+    try:
+        return function(*args)
+    finally:
+        startup_report.setdefault(label, time.perf_counter() - start)
+
+
+def measure_since_load(label):
+    """Add the time since the plugin was loaded to the startup report.
+
+    Only the first call with a given label is recorded."""
+    if plugin_loaded_at is not None and label not in startup_report:
+        startup_report[label] = time.perf_counter() - plugin_loaded_at
+
+
 def reload_settings():
-    settings = get_settings()
-    settings.add_on_change(constants.PLUGIN_NAME, reload_settings)
+    """Compile the settings that Exalt uses in a compiled form."""
+    global association_index
+
+    association_index = associations.AssociationIndex(
+        get_setting(settings.SCHEMA_ASSOCIATIONS, [])
+    )
+
+    # Don't let a broken rule keep the plugin from loading, but don't ignore
+    # it silently either.
+    for rule in association_index.invalid:
+        print(messages.INVALID_ASSOCIATION % (rule,))
+
+    if association_index.invalid:
+        sublime.status_message(messages.INVALID_ASSOCIATIONS %
+                               len(association_index.invalid))
 
 
 def plugin_loaded():
@@ -80,11 +131,31 @@ def plugin_loaded():
     # works only *after* plugins have finished loading.
     #
     # As a workaround, we'll wait until this plugin has finished loading and
-    # only then load the files that import and use lxml.
-    sublime_plugin.reload_plugin("%s.impl.plugin" % constants.PLUGIN_NAME)
-    sublime_plugin.reload_plugin("%s.impl.validator" % constants.PLUGIN_NAME)
-    sublime_plugin.reload_plugin("%s.impl.formatter" % constants.PLUGIN_NAME)
+    # only then load the commands. The commands load the files that import
+    # and use lxml the first time they need them, so that users who don't
+    # edit XML all the time don't have to wait for lxml to load every time
+    # Sublime Text starts.
+    global plugin_loaded_at
+    plugin_loaded_at = time.perf_counter()
+
+    startup_report.clear()
+
+    get_settings().add_on_change(constants.PLUGIN_NAME, reload_settings)
+    reload_settings()
+
+    measure("plugin_loaded",
+            sublime_plugin.reload_plugin,
+            "%s.impl.plugin" % constants.PLUGIN_NAME)
 
 
 def plugin_unloaded():
+    get_settings().clear_on_change(constants.PLUGIN_NAME)
     parser_cache.clear()
+    document_cache.clear()
+    include_cache.clear()
+    xpath_cache.clear()
+    xslt_cache.clear()
+    content_models.clear()
+    error_indexes.clear()
+    linters.clear()
+    outlines.clear()
@@ -0,0 +1,223 @@
+"""Rules that associate documents with schemas.
+
+Many documents don't say which schema they use. The schema_associations
+setting lists rules that pick a schema for a document by the namespace or
+the local name of its root element, the public identifier in its DOCTYPE,
+or a glob pattern that its path matches. For example:
+
+    "schema_associations": [
+      {
+        "namespace": "http://docbook.org/ns/docbook",
+        "schema": "/etc/xml/docbook/docbook.rng"
+      },
+      {
+        "glob": "*/pom.xml",
+        "schema": "http://maven.apache.org/xsd/maven-4.0.0.xsd"
+      }
+    ]
+
+If a rule has more than one condition, a document must meet all of them.
+The first rule that matches a document wins.
+
+The rules are compiled into an index when the settings are loaded, and
+the index only needs the prolog of a document, so finding the schema for a
+document doesn't require parsing it."""
+
+import fnmatch
+import os
+import re
+
+import Exalt.namespaces as namespaces
+
+# The number of characters at the start of a document we look at to find its
+# root element.
+PROLOG_SIZE = 4096
+
+PROLOG = re.compile(r"""
+    \s+
+  | <\?.*?\?>
+  | <!--.*?-->
+  | <!DOCTYPE\s+[^\s\[>]+
+        (?:\s+PUBLIC\s+(?:"(?P<public_id>[^"]*)"|'(?P<public_id_>[^']*)'))?
+        (?:[^\[>]|\[.*?\])*>
+  | <(?P<root>[^\s/>]+)(?P<attributes>[^>]*)
+""", re.S | re.X)
+
+NAMESPACE_DECLARATION = re.compile(r"""
+    \bxmlns(?::(?P<prefix>[^\s=]+))?\s*=\s*(?:"(?P<uri>[^"]*)"|'(?P<uri_>[^']*)')
+""", re.X)
+
+SCHEMA_TYPES = {
+    "dtd": "dtd",
+    "rng": namespaces.RELAXNG,
+    "xsd": namespaces.XML_SCHEMA,
+    "sch": namespaces.SCHEMATRON
+}
+
+
+class Prolog:
+    """What the prolog of a document tells about the document."""
+
+    def __init__(self, public_id=None, root=None, namespace=None):
+        self.public_id = public_id
+        self.root = root
+        self.namespace = namespace
+
+
+class Association:
+    """A rule that associates the documents that match it with a schema."""
+
+    def __init__(self, rule):
+        self.namespace = rule.get("namespace")
+        self.root = rule.get("root")
+        self.public_id = rule.get("public_id")
+        self.glob = rule.get("glob")
+        self.schema = _expand(rule["schema"])
+        self.schema_type = get_schema_type(rule)
+
+        self.pattern = re.compile(fnmatch.translate(self.glob)) \
+            if self.glob else None
+
+    def matches(self, path, prolog):
+        if self.namespace is not None and self.namespace != prolog.namespace:
+            return False
+
+        if self.root is not None and self.root != prolog.root:
+            return False
+
+        if self.public_id is not None and \
+           self.public_id != prolog.public_id:
+            return False
+
+        if self.pattern is not None:
+            if path is None:
+                return False
+
+            # Patterns without a directory part match the file name only.
+            subject = path.replace(os.sep, "/") if "/" in self.glob \
+                else os.path.basename(path)
+
+            if not self.pattern.match(subject):
+                return False
+
+        return True
+
+
+class AssociationIndex:
+    """The association rules, indexed by the condition that narrows down the
+    rules the most.
+
+    Rules that don't name a schema are left out of the index and kept in
+    invalid, so that we can tell the user about them."""
+
+    def __init__(self, rules):
+        self.by_public_id = {}
+        self.by_namespace = {}
+        self.by_root = {}
+        self.by_glob = []
+        self.invalid = []
+
+        for position, rule in enumerate(rules):
+            if not is_valid(rule):
+                self.invalid.append(rule)
+                continue
+
+            association = Association(rule)
+            entry = (position, association)
+
+            if association.public_id is not None:
+                self.by_public_id.setdefault(association.public_id,
+                                             []).append(entry)
+            elif association.namespace is not None:
+                self.by_namespace.setdefault(association.namespace,
+                                             []).append(entry)
+            elif association.root is not None:
+                self.by_root.setdefault(association.root, []).append(entry)
+            elif association.pattern is not None:
+                self.by_glob.append(entry)
+
+    def __bool__(self):
+        return bool(self.by_public_id or self.by_namespace or
+                    self.by_root or self.by_glob)
+
+    def find(self, path, prolog):
+        """Get the association of the first rule that matches the document
+        at path with the given prolog, or None if no rule matches."""
+        candidates = self.by_public_id.get(prolog.public_id, []) + \
+            self.by_namespace.get(prolog.namespace, []) + \
+            self.by_root.get(prolog.root, []) + \
+            self.by_glob
+
+        for _, association in sorted(candidates, key=lambda e: e[0]):
+            if association.matches(path, prolog):
+                return association
+
+        return None
+
+
+def is_valid(rule):
+    """Check that the rule is an object that names a schema."""
+    return isinstance(rule, dict) and \
+        isinstance(rule.get("schema"), str) and bool(rule["schema"])
+
+
+def get_schema_type(rule):
+    """Get the namespace of the schema language of the schema in the rule,
+    or "dtd" for DTDs.
+
+    Unless the rule says which schema language the schema uses, we guess it
+    from the file name extension of the schema."""
+    schema_type = rule.get("type")
+
+    if schema_type is None:
+        _, extension = os.path.splitext(rule["schema"])
+        schema_type = extension.lstrip(".").lower()
+
+    return SCHEMA_TYPES.get(schema_type, schema_type)
+
+
+def scan(text):
+    """Get the Prolog of the document that starts with text."""
+    public_id = None
+    pos = 0
+
+    while pos < len(text):
+        match = PROLOG.match(text, pos)
+
+        if match is None:
+            break
+
+        if match.group("root") is not None:
+            return _get_root(public_id, match)
+
+        if match.group("public_id") is not None or \
+           match.group("public_id_") is not None:
+            public_id = match.group("public_id") or match.group("public_id_")
+
+        pos = match.end()
+
+    return Prolog(public_id)
+
+
+###########
+# PRIVATE #
+###########
+
+
+def _get_root(public_id, match):
+    prefix, _, local_name = match.group("root").rpartition(":")
+    namespace = None
+
+    for declaration in NAMESPACE_DECLARATION.finditer(
+            match.group("attributes")):
+        if (declaration.group("prefix") or "") == prefix:
+            namespace = declaration.group("uri") or declaration.group("uri_")
+
+    return Prolog(public_id, local_name, namespace)
+
+
+def _expand(schema):
+    if re.match(r"^[A-Za-z][A-Za-z0-9+.-]+:", schema):
+        return schema
+
+    return os.path.expanduser(schema)
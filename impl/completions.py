@@ -0,0 +1,137 @@
+"""Completions for the elements, attributes and attribute values the schema
+of a document allows at the cursor.
+
+The content model of the schema comes from the validator (see
+contentmodel.py). To answer quickly, we only look at the text right before
+the cursor, both to find out what the user is typing and to find the element
+the cursor is in."""
+
+import re
+
+# How many characters before the cursor we look at to find the start of the
+# tag the cursor is in.
+CONTEXT_SIZE = 2048
+
+# How many characters before the cursor we look at, at most, to find the
+# element the cursor is in.
+PARENT_CONTEXT_SIZE = 32768
+
+# The parent of the cursor when we didn't find it within PARENT_CONTEXT_SIZE.
+UNKNOWN = object()
+
+# What the user is typing.
+ELEMENT = "element"
+ATTRIBUTE = "attribute"
+VALUE = "value"
+CONTENT = "content"
+
+TAG = re.compile(r"<(?P<name>[^\s<>/!?=\"']*)(?P<rest>[^<>]*)\Z")
+
+ATTRIBUTE_NAME = re.compile(r"""
+    (?:\s+[^\s=]+\s*=\s*(?:"[^"]*"|'[^']*'))*\s+[^\s="']*\Z
+""", re.X)
+
+ATTRIBUTE_VALUE = re.compile(r"""
+    \s(?P<attribute>[^\s=]+)\s*=\s*["'][^"']*\Z
+""", re.X)
+
+
+# A tag, or markup that can contain something that looks like one.
+TAGS = re.compile(r"""
+    <!--.*?-->
+  | <!\[CDATA\[.*?\]\]>
+  | <\?.*?\?>
+  | <!DOCTYPE(?:[^\[>]|\[.*?\])*>
+  | <(?P<end>/)?(?P<name>[^\s<>/!?=\"']+)
+      (?:[^<>"']|"[^"]*"|'[^']*')*?(?P<empty>/)?>
+""", re.S | re.X)
+
+
+class Context:
+    """Where the cursor is.
+
+    start is the position of the tag the cursor is in, or of the cursor if
+    the cursor isn't in a tag. element is the name of the tag and attribute
+    the name of the attribute whose value the cursor is in, if any."""
+
+    def __init__(self, kind, start, element=None, attribute=None):
+        self.kind = kind
+        self.start = start
+        self.element = element
+        self.attribute = attribute
+
+
+def get_context(text, offset):
+    """Get the Context of the cursor at the end of text, which starts at
+    offset in the document, or None if there's nothing to complete there."""
+    open_at = text.rfind("<")
+
+    if open_at <= text.rfind(">"):
+        return Context(CONTENT, offset + len(text))
+
+    match = TAG.match(text, open_at)
+
+    if match is None or text[open_at + 1:open_at + 2] in ("/", "!", "?"):
+        return None
+
+    start = offset + open_at
+    name = match.group("name")
+    rest = match.group("rest")
+
+    if not rest:
+        return Context(ELEMENT, start)
+
+    value = ATTRIBUTE_VALUE.search(rest)
+
+    if value is not None:
+        return Context(VALUE, start, name, value.group("attribute"))
+    elif ATTRIBUTE_NAME.match(rest):
+        return Context(ATTRIBUTE, start, name)
+    else:
+        return None
+
+
+def get_parent(text):
+    """Get the name of the innermost element that's open at the end of text,
+    or None if every element that starts in text also ends in it."""
+    stack = []
+
+    for match in TAGS.finditer(text):
+        name = match.group("name")
+
+        if name is None or match.group("empty"):
+            continue
+        elif not match.group("end"):
+            stack.append(name)
+        elif name in stack:
+            del stack[len(stack) - 1 - stack[::-1].index(name):]
+
+    return stack[-1] if stack else None
+
+
+def get_completions(model, context, parent):
+    """Get the Sublime Text completions for the context from the content
+    model.
+
+    The parent is the name of the element the cursor is in, None if the
+    cursor is outside the root element, or UNKNOWN if we don't know."""
+    if context.kind in (ELEMENT, CONTENT):
+        if parent is UNKNOWN:
+            names = model.everything
+        elif parent is not None:
+            names = model.get_children(parent)
+        else:
+            names = model.roots
+
+        if context.kind == ELEMENT:
+            return [["%s\telement" % name, name] for name in names]
+
+        return [["%s\telement" % name, "<%s>$0</%s>" % (name, name)]
+                for name in names]
+    elif context.kind == ATTRIBUTE:
+        return [["%s\tattribute" % name, "%s=\"$1\"$0" % name]
+                for name in sorted(model.get_attributes(context.element))]
+    else:
+        values = model.get_attributes(context.element).get(context.attribute,
+                                                           ())
+        return [["%s\tvalue" % value, value] for value in values]
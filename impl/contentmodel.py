@@ -0,0 +1,441 @@
+"""Content models extracted from schemas.
+
+To validate a document, we only need the compiled schema. To suggest the
+elements and attributes the user can type, we need to know which elements
+and attributes the schema allows where. We extract that from the schema once,
+when a document is first validated against it, and cache it in the parser
+cache next to the compiled schema, so that answering a completion request
+only takes a couple of dict lookups.
+
+The extraction is best effort. A content model only records which elements
+can appear in which, not in which order or how many times. Elements are
+identified by their local names, because that's all lxml tells about the
+elements in the content models of a DTD."""
+
+from urllib.parse import urljoin
+
+from lxml import etree
+
+import Exalt.namespaces as namespaces
+
+# The key of the content model of a schema in the parser cache is
+# (KEY, schema identifier).
+KEY = "content-model"
+
+XS = {"xs": namespaces.XML_SCHEMA}
+RNG = {"rng": namespaces.RELAXNG}
+
+XS_INCLUDES = "/xs:schema/xs:include/@schemaLocation" \
+    " | /xs:schema/xs:import/@schemaLocation" \
+    " | /xs:schema/xs:redefine/@schemaLocation"
+
+RNG_INCLUDES = "//rng:include/@href | //rng:externalRef/@href"
+
+# RelaxNG elements whose content we never look into when looking for the
+# elements and attributes a pattern allows.
+RNG_LEAVES = {"name", "anyName", "nsName", "except", "value", "data", "param",
+              "text", "empty", "notAllowed", "parentRef", "grammar"}
+
+
+class ContentModel:
+    """The elements a schema declares, the elements that can appear in each
+    of them, and the attributes they can have, with the values of enumerated
+    attributes."""
+
+    def __init__(self):
+        self.children = {}
+        self.attributes = {}
+        self.roots = set()
+        self.open = set()
+        self.everything = ()
+
+    def add_element(self, name, children=(), attributes=None):
+        """Add the children and attributes to the element called name. If the
+        element is already in the model, merge them with what it already
+        has."""
+        self.children.setdefault(name, set()).update(children)
+        existing = self.attributes.setdefault(name, {})
+
+        for attribute, values in (attributes or {}).items():
+            existing.setdefault(attribute, set()).update(values)
+
+    def freeze(self):
+        """Sort the names in the model once so that lookups don't have to."""
+        self.everything = tuple(sorted(self.children))
+
+        if not self.roots:
+            nested = set().union(*self.children.values())
+            self.roots = set(self.children) - nested
+
+        self.children = {name: self.everything if name in self.open
+                         else tuple(sorted(children))
+                         for name, children in self.children.items()}
+
+        self.attributes = {name: {attribute: tuple(sorted(values))
+                                  for attribute, values in attributes.items()}
+                           for name, attributes in self.attributes.items()}
+
+        self.roots = tuple(sorted(self.roots)) or self.everything
+        return self
+
+    def get_children(self, name):
+        """Get the names of the elements that can appear in the element called
+        name, or the names of all elements if the schema doesn't declare
+        it."""
+        return self.children.get(_get_local_name(name), self.everything)
+
+    def get_attributes(self, name):
+        """Get a dict of the attributes of the element called name and their
+        enumerated values."""
+        return self.attributes.get(_get_local_name(name), {})
+
+
+def extract(parser, source, validator):
+    """Get the content model of a schema, or None if we can't extract content
+    models from schemas of that kind.
+
+    The parser is the lxml class that compiled the schema, source is the file
+    it compiled it from and validator is the compiled schema."""
+    if parser is etree.DTD:
+        return from_dtd(validator)
+    elif parser is etree.XMLSchema:
+        return from_xml_schema(source)
+    elif parser is etree.RelaxNG:
+        return from_relaxng(source)
+    else:
+        return None
+
+
+def from_dtd(dtd):
+    """Get the content model of a compiled etree.DTD."""
+    model = ContentModel()
+
+    for element in dtd.iterelements():
+        name = element.name
+        attributes = {_get_qname(attribute.prefix, attribute.name):
+                      attribute.values()
+                      for attribute in element.iterattributes()}
+
+        model.add_element(name, _get_dtd_children(element.content),
+                          attributes)
+
+        if element.type == "any":
+            model.open.add(name)
+
+    return model.freeze()
+
+
+def from_xml_schema(source):
+    """Get the content model of the XML Schema at source and the schemas it
+    includes or imports."""
+    return _XmlSchema(_load(source, XS_INCLUDES, XS)).extract()
+
+
+def from_relaxng(source):
+    """Get the content model of the RelaxNG schema at source and the schemas
+    it includes."""
+    return _RelaxNg(_load(source, RNG_INCLUDES, RNG)).extract()
+
+
+###########
+# PRIVATE #
+###########
+
+
+def _get_qname(prefix, name):
+    return "%s:%s" % (prefix, name) if prefix else name
+
+
+def _get_local_name(name):
+    return name.rpartition(":")[2]
+
+
+def _get_dtd_children(content):
+    names = set()
+    pending = [content]
+
+    while pending:
+        particle = pending.pop()
+
+        if particle is None:
+            continue
+        elif particle.type == "element":
+            names.add(particle.name)
+        else:
+            pending.extend((particle.left, particle.right))
+
+    return names
+
+
+def _load(source, includes, prefixes):
+    """Parse the schema at source and every schema it includes, directly or
+    indirectly."""
+    trees = []
+    seen = set()
+    pending = [source]
+
+    while pending:
+        url = pending.pop()
+
+        if url in seen:
+            continue
+
+        seen.add(url)
+
+        try:
+            tree = etree.parse(url)
+        except (OSError, etree.XMLSyntaxError):
+            continue
+
+        trees.append(tree)
+        base = tree.docinfo.URL or url
+
+        pending.extend(urljoin(base, href)
+                       for href in tree.xpath(includes, namespaces=prefixes))
+
+    return trees
+
+
+class _XmlSchema:
+    def __init__(self, trees):
+        self.declarations = []
+        self.elements = {}
+        self.types = {}
+        self.groups = {}
+        self.attribute_groups = {}
+        self.simple_types = {}
+        self.global_attributes = {}
+        self.substitutes = {}
+
+        tables = {"element": self.elements,
+                  "complexType": self.types,
+                  "group": self.groups,
+                  "attributeGroup": self.attribute_groups,
+                  "simpleType": self.simple_types,
+                  "attribute": self.global_attributes}
+
+        for tree in trees:
+            for child in tree.getroot().iterchildren(etree.Element):
+                table = tables.get(etree.QName(child).localname)
+
+                if table is not None and child.get("name"):
+                    table.setdefault(child.get("name"), child)
+
+            for element in tree.iter("{%s}element" % namespaces.XML_SCHEMA):
+                if element.get("name"):
+                    self.declarations.append(element)
+
+                head = element.get("substitutionGroup")
+
+                if head and element.get("name"):
+                    self.substitutes.setdefault(_get_local_name(head),
+                                                []).append(element.get("name"))
+
+    def extract(self):
+        model = ContentModel()
+
+        for declaration in self.declarations:
+            children = set()
+            attributes = {}
+            visited = set()
+
+            if declaration.get("type"):
+                self._walk_type(_get_local_name(declaration.get("type")),
+                                children, attributes, visited)
+
+            self._walk(declaration, children, attributes, visited)
+            model.add_element(declaration.get("name"), children, attributes)
+
+        model.roots.update(self.elements)
+        return model.freeze()
+
+    def _walk(self, node, children, attributes, visited):
+        for child in node.iterchildren(etree.Element):
+            kind = etree.QName(child).localname
+
+            if kind == "element":
+                name = child.get("name") or \
+                    _get_local_name(child.get("ref", ""))
+
+                if name:
+                    children.add(name)
+                    children.update(self._get_substitutes(name))
+            elif kind == "attribute":
+                name = child.get("name") or \
+                    _get_local_name(child.get("ref", ""))
+
+                if name:
+                    attributes.setdefault(name, set()).update(
+                        self._get_values(child)
+                    )
+            elif kind == "group" and child.get("ref"):
+                self._walk_reference(self.groups, child.get("ref"),
+                                     children, attributes, visited)
+            elif kind == "attributeGroup" and child.get("ref"):
+                self._walk_reference(self.attribute_groups, child.get("ref"),
+                                     children, attributes, visited)
+            elif kind in ("extension", "restriction"):
+                if child.get("base"):
+                    self._walk_type(_get_local_name(child.get("base")),
+                                    children, attributes, visited)
+
+                self._walk(child, children, attributes, visited)
+            elif kind != "annotation":
+                self._walk(child, children, attributes, visited)
+
+    def _walk_type(self, name, children, attributes, visited):
+        self._walk_reference(self.types, name, children, attributes, visited)
+
+    def _walk_reference(self, table, name, children, attributes, visited):
+        name = _get_local_name(name)
+        definition = table.get(name)
+
+        if definition is not None and id(definition) not in visited:
+            visited.add(id(definition))
+            self._walk(definition, children, attributes, visited)
+
+    def _get_substitutes(self, name):
+        found = []
+        pending = [name]
+
+        while pending:
+            for substitute in self.substitutes.get(pending.pop(), ()):
+                if substitute not in found:
+                    found.append(substitute)
+                    pending.append(substitute)
+
+        return found
+
+    def _get_values(self, attribute):
+        if attribute.get("ref"):
+            attribute = self.global_attributes.get(
+                _get_local_name(attribute.get("ref")), attribute
+            )
+
+        definitions = [attribute]
+
+        if attribute.get("type"):
+            simple_type = self.simple_types.get(
+                _get_local_name(attribute.get("type"))
+            )
+
+            if simple_type is not None:
+                definitions.append(simple_type)
+
+        return [value for definition in definitions
+                for value in definition.xpath(".//xs:enumeration/@value",
+                                              namespaces=XS)]
+
+
+class _RelaxNg:
+    def __init__(self, trees):
+        self.trees = trees
+        self.defines = {}
+        self.starts = []
+
+        for tree in trees:
+            root = tree.getroot()
+
+            for node in root.iter("{%s}define" % namespaces.RELAXNG,
+                                  "{%s}start" % namespaces.RELAXNG):
+                # Patterns in nested grammars refer to the defines of the
+                # nested grammar, which we don't track.
+                if self._is_nested(root, node):
+                    continue
+
+                if etree.QName(node).localname == "start":
+                    self.starts.append(node)
+                else:
+                    self.defines.setdefault(node.get("name"), []).append(node)
+
+    def extract(self):
+        model = ContentModel()
+
+        for tree in self.trees:
+            root = tree.getroot()
+
+            for element in tree.iter("{%s}element" % namespaces.RELAXNG):
+                if self._is_nested(root, element):
+                    continue
+
+                children = set()
+                attributes = {}
+                self._walk(element, children, attributes, set())
+
+                for name in self._get_names(element):
+                    model.add_element(name, children, attributes)
+
+        for start in self.starts:
+            self._walk(start, model.roots, {}, set())
+
+        return model.freeze()
+
+    def _walk(self, node, children, attributes, visited):
+        for child in node.iterchildren(etree.Element):
+            kind = etree.QName(child).localname
+
+            if kind == "element":
+                children.update(self._get_names(child))
+            elif kind == "attribute":
+                values = self._get_values(child, set())
+
+                for name in self._get_names(child):
+                    attributes.setdefault(name, set()).update(values)
+            elif kind == "ref":
+                for define in self._resolve(child, visited):
+                    self._walk(define, children, attributes, visited)
+            elif kind not in RNG_LEAVES:
+                self._walk(child, children, attributes, visited)
+
+    def _get_values(self, node, visited):
+        values = []
+
+        for child in node.iterchildren(etree.Element):
+            kind = etree.QName(child).localname
+
+            if kind == "value":
+                values.append((child.text or "").strip())
+            elif kind == "ref":
+                for define in self._resolve(child, visited):
+                    values.extend(self._get_values(define, visited))
+            elif kind in ("choice", "group"):
+                values.extend(self._get_values(child, visited))
+
+        return values
+
+    def _resolve(self, ref, visited):
+        name = ref.get("name")
+
+        if name in visited:
+            return []
+
+        visited.add(name)
+        return self.defines.get(name, [])
+
+    def _get_names(self, pattern):
+        if pattern.get("name"):
+            return [_get_local_name(pattern.get("name").strip())]
+
+        name_class = next(pattern.iterchildren(etree.Element), None)
+
+        if name_class is None:
+            return []
+
+        kind = etree.QName(name_class).localname
+
+        if kind == "name":
+            return [_get_local_name((name_class.text or "").strip())]
+        elif kind == "choice":
+            return [_get_local_name((name.text or "").strip())
+                    for name in name_class.iter("{%s}name" %
+                                                namespaces.RELAXNG)]
+        else:
+            return []
+
+    def _is_nested(self, root, node):
+        grammars = sum(1 for _ in node.iterancestors(
+            "{%s}grammar" % namespaces.RELAXNG
+        ))
+
+        return grammars > (1 if root.tag == "{%s}grammar" %
+                           namespaces.RELAXNG else 0)
@@ -0,0 +1,278 @@
+"""An index of the references between the files in the open folders.
+
+Saving one file of a DITA map, a DocBook assembly or an XSLT import chain can
+break the files that reference it. The dependency index records which files
+each file references via href, conref, xsi:schemaLocation and the like, so
+that when a file is saved, we can find every file that depends on it,
+directly or via other files, and revalidate just those."""
+
+import bisect
+import itertools
+import os
+import re
+import threading
+
+import urllib.request as urllib
+
+from urllib.parse import unquote, urlparse
+
+import sublime
+
+REFERENCE = re.compile(r"""
+    \b(?:(?P<prefix>[\w.-]+):)?
+    (?P<attribute>href|conref|schemaLocation|noNamespaceSchemaLocation)
+    \s*=\s*(?:"(?P<double>[^"]*)"|'(?P<single>[^']*)')
+""", re.X)
+
+DOCTYPE = re.compile(r"""
+    <!DOCTYPE\s+\S+\s+
+    (?:SYSTEM|PUBLIC\s+(?:"[^"]*"|'[^']*'))
+    \s+(?:"(?P<double>[^"]*)"|'(?P<single>[^']*)')
+""", re.X)
+
+
+def get_references(path, text):
+    """Get the absolute paths of the local files the text of the file at path
+    references."""
+    directory = os.path.dirname(path)
+    references = set()
+
+    for pattern in (REFERENCE, DOCTYPE):
+        for match in pattern.finditer(text):
+            value = match.group("double") or match.group("single") or ""
+
+            # xsi:schemaLocation is a list of namespace-location pairs, but
+            # the unprefixed schemaLocation of xs:include, xs:import and
+            # xs:redefine is a single URI.
+            if match.groupdict().get("attribute") == "schemaLocation" and \
+               match.group("prefix"):
+                hrefs = value.split()[1::2]
+            else:
+                hrefs = [value]
+
+            for href in hrefs:
+                reference = resolve(directory, href)
+
+                if reference is not None:
+                    references.add(reference)
+
+    references.discard(path)
+    return references
+
+
+class DependencyIndex:
+    """The references between the files in a set of folders."""
+
+    def __init__(self, extensions):
+        self.extensions = tuple(extensions)
+        self.lock = threading.Lock()
+        self.references = {}
+        self.dependents = {}
+        self.stamps = {}
+        self.folders = None
+
+    def refresh(self, folders):
+        """Bring the index up to date with the files in the given folders.
+
+        Only the files that have changed since the last refresh are read."""
+        seen = set()
+
+        for folder in folders:
+            for directory, _, files in os.walk(folder):
+                for name in files:
+                    if name.lower().endswith(self.extensions):
+                        path = os.path.normpath(os.path.join(directory, name))
+                        seen.add(path)
+                        self.update(path)
+
+        for path in set(self.stamps) - seen:
+            self.remove(path)
+
+    def track(self, folders, path):
+        """Bring the index up to date after the file at path was saved.
+
+        The folders are only walked the first time and when they change.
+        After that, only the saved file is read again."""
+        folders = sorted(os.path.normpath(folder) for folder in folders)
+
+        if folders != self.folders:
+            self.refresh(folders)
+            self.folders = folders
+        elif path.lower().endswith(self.extensions):
+            self.update(os.path.normpath(path))
+
+    def update(self, path):
+        """Read the references of the file at path if it has changed since the
+        last time we read them."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.remove(path)
+            return
+
+        stamp = (stat.st_mtime_ns, stat.st_size)
+
+        if self.stamps.get(path) == stamp:
+            return
+
+        try:
+            with open(path, encoding="utf-8", errors="replace") as file:
+                references = get_references(path, file.read())
+        except OSError:
+            references = set()
+
+        with self.lock:
+            self._set_references(path, references)
+            self.stamps[path] = stamp
+
+    def remove(self, path):
+        with self.lock:
+            self._set_references(path, set())
+            self.stamps.pop(path, None)
+
+    def get_dependents(self, path):
+        """Get every indexed file that depends on the file at path, directly
+        or via other files."""
+        path = os.path.normpath(path)
+        found = set()
+        pending = [path]
+
+        with self.lock:
+            while pending:
+                for dependent in self.dependents.get(pending.pop(), ()):
+                    if dependent not in found and dependent != path:
+                        found.add(dependent)
+                        pending.append(dependent)
+
+        return found
+
+    def _set_references(self, path, references):
+        for reference in self.references.pop(path, ()):
+            dependents = self.dependents.get(reference)
+
+            if dependents is not None:
+                dependents.discard(path)
+
+                if not dependents:
+                    del self.dependents[reference]
+
+        if references:
+            self.references[path] = references
+
+        for reference in references:
+            self.dependents.setdefault(reference, set()).add(path)
+
+
+class HeadlessView:
+    """A read-only stand-in for a sublime.View of a file that isn't open.
+
+    It implements just enough of the View API for the validator to validate
+    the file on disk and report its errors."""
+
+    ids = itertools.count(-1, -1)
+
+    def __init__(self, path, syntax):
+        self.path = path
+        self.view_id = next(self.ids)
+        self.statuses = {}
+        self.text = None
+        self.lines = None
+        self.view_settings = {"syntax": syntax}
+
+    def id(self):
+        return self.view_id
+
+    def file_name(self):
+        return self.path
+
+    def window(self):
+        return None
+
+    def is_valid(self):
+        return True
+
+    def is_dirty(self):
+        return False
+
+    def change_count(self):
+        return 0
+
+    def size(self):
+        return os.path.getsize(self.path)
+
+    def settings(self):
+        return self.view_settings
+
+    def substr(self, region):
+        self._get_lines()
+        return self.text[region.begin():region.end()]
+
+    def sel(self):
+        return [sublime.Region(0)]
+
+    def scope_name(self, point):
+        return "text.xml "
+
+    def set_status(self, key, value):
+        self.statuses[key] = value
+
+    def get_status(self, key):
+        return self.statuses.get(key, "")
+
+    def erase_status(self, key):
+        self.statuses.pop(key, None)
+
+    def text_point(self, row, col):
+        lines = self._get_lines()
+        return lines[min(max(0, row), len(lines) - 1)] + col
+
+    def rowcol(self, point):
+        lines = self._get_lines()
+        row = bisect.bisect_right(lines, point) - 1
+        return row, point - lines[row]
+
+    def line(self, point):
+        row, _ = self.rowcol(point)
+        lines = self._get_lines()
+        end = lines[row + 1] - 1 if row + 1 < len(lines) else len(self.text)
+        return sublime.Region(lines[row], end)
+
+    def visible_region(self):
+        return sublime.Region(0, 0)
+
+    def add_regions(self, *args, **kwargs):
+        pass
+
+    def erase_regions(self, key):
+        pass
+
+    def show_at_center(self, point):
+        pass
+
+    def _get_lines(self):
+        if self.lines is None:
+            with open(self.path, encoding="utf-8", errors="replace") as file:
+                self.text = file.read()
+
+            self.lines = [0] + [match.end() for match in
+                                re.finditer("\n", self.text)]
+
+        return self.lines
+
+
+def resolve(directory, href):
+    """Get the absolute path of the local file href refers to, relative to
+    directory, or None if href doesn't refer to a local file."""
+    url = urlparse(href)
+
+    if url.scheme == "file":
+        path = urllib.url2pathname(url.path)
+    elif url.scheme and not os.path.isabs(href):
+        return None
+    else:
+        path = unquote(href.split("#")[0])
+
+    if not path:
+        return None
+
+    return os.path.normpath(os.path.join(directory, path))
@@ -1,15 +1,31 @@
+import copy
+import sublime
+
 import Exalt.view as vu
 import Exalt.messages as messages
 import Exalt.encodings as encodings
 
 from lxml import etree
 
+import Exalt.impl.fragments as fragments
 import Exalt.impl.parsetools as parsetools
 
 from io import BytesIO
 
+EMPTY_SCRIPTS = "//script[@src][not(normalize-space(.))]"
+
+# The number of characters to read from the view or to write into it at a
+# time when streaming.
+CHUNK_SIZE = 65536
+
 
 def format_markup(markup, view, **kwargs):
+    return serialize(markup, vu.is_html(view), **kwargs)
+
+
+def serialize(markup, html, **kwargs):
+    """Pretty-print a parsed document. If html is True, the document is an
+    HTML document."""
     encoding = markup.docinfo.encoding
 
     # lxml only indents HTML if method == "xml", but then it will self-close
@@ -17,8 +33,13 @@ def format_markup(markup, view, **kwargs):
     #
     # This hack adds a single space into any empty <script> elements, which
     # forces lxml to add the closing tag.
-    if (vu.is_html(view)):
-        for script in markup.xpath("//script[@src][not(normalize-space(.))]"):
+    #
+    # The tree might come from the parsed document cache, so we only change
+    # a copy of it.
+    if html and markup.xpath(EMPTY_SCRIPTS):
+        markup = copy.deepcopy(markup)
+
+        for script in markup.xpath(EMPTY_SCRIPTS):
             script.text = " "
 
     return etree.tostring(
@@ -29,27 +50,130 @@ def format_markup(markup, view, **kwargs):
     ).decode(encoding)
 
 
+def parse_region(view, region, profile):
+    """Parse the region, reusing the parsed document if the region spans the
+    entire view."""
+    if region.begin() == 0 and region.end() == view.size():
+        return parsetools.parse_view(view, profile)
+    else:
+        return parsetools.parse_region(view, profile, region)
+
+
 def format_region(view, region, **kwargs):
     if vu.is_eligible(view):
         try:
-            parser = parsetools.get_parser(view,
-                                           encoding=encodings.UTF8,
-                                           remove_blank_text=True,
-                                           recover=True)
-
-            markup = parsetools.parse_string(view, parser, view.substr(region))
+            markup = parse_region(view, region, "format")
             return format_markup(markup, view, **kwargs)
         except etree.XMLSyntaxError:
             vu.set_status(view, messages.NOT_WELL_FORMED_XML)
             vu.reset_status(view)
 
 
-def canonicalize_document(view, region):
-    parser = parsetools.get_parser(view,
-                                   encoding=encodings.UTF8,
-                                   remove_blank_text=True)
+def format_fragment(kind, options, text):
+    """Format a single document of a buffer that holds many documents.
+
+    The kind ("xml" or "html") and the parser options come from the view, but
+    this runs on the thread pool, so they're looked up once up front instead
+    of asking the view for every document.
+
+    Get the formatted document and None, or, if the document isn't
+    well-formed, the document as it is and an (offset, message) record of
+    the first error in it. Unlike format_region, this doesn't try to recover
+    from errors, because recovering can silently drop content."""
+    options = dict(options, recover=False)
+
+    with parsetools.pooled_parser_for(kind, **options) as parser:
+        try:
+            root = etree.fromstring(text.encode(encodings.UTF8), parser)
+        except etree.XMLSyntaxError as e:
+            return text, _get_error_record(text, e)
+
+    formatted = serialize(root.getroottree(), kind == "html",
+                          xml_declaration=text.startswith("<?xml"))
+
+    return formatted.rstrip("\n"), None
+
+
+def check_fragment(kind, options, text):
+    """Check whether a single document of a buffer that holds many documents
+    is well-formed.
+
+    Get the document as it is and an (offset, message) record of the first
+    error in it, or None if it's well-formed."""
+    with parsetools.pooled_parser_for(kind, **options) as parser:
+        try:
+            etree.fromstring(text.encode(encodings.UTF8), parser)
+        except etree.XMLSyntaxError as e:
+            return text, _get_error_record(text, e)
 
-    xml = parsetools.parse_string(view, parser, view.substr(region))
+    return text, None
+
+
+def canonicalize_document(view, region, exclusive=False, with_comments=False,
+                          inclusive_ns_prefixes=None):
+    """Canonicalize the region with C14N 1.0, optionally exclusive C14N."""
+    xml = parse_region(view, region, "canonicalize")
     output = BytesIO()
-    xml.write_c14n(output)
+
+    xml.write_c14n(output,
+                   exclusive=exclusive,
+                   with_comments=with_comments,
+                   inclusive_ns_prefixes=inclusive_ns_prefixes)
+
     return output.getvalue().decode(xml.docinfo.encoding)
+
+
+def stream_canonicalized_document(view, region, write, **kwargs):
+    """Canonicalize the region with C14N 2.0 and pass the output to write
+    in chunks.
+
+    Instead of building a tree, the parser passes its events straight to
+    the C14N 2.0 serializer, so canonicalizing a document takes the same
+    amount of memory no matter how large the document is. The keyword
+    arguments go to etree.C14NWriterTarget."""
+    output = _ChunkedWriter(write)
+    target = etree.C14NWriterTarget(output.write, **kwargs)
+    parser = etree.XMLParser(target=target,
+                             encoding=encodings.UTF8,
+                             huge_tree=parsetools.is_large(view))
+
+    for begin in range(region.begin(), region.end(), CHUNK_SIZE):
+        end = min(begin + CHUNK_SIZE, region.end())
+        chunk = view.substr(sublime.Region(begin, end))
+        parser.feed(chunk.encode(encodings.UTF8))
+
+    parser.close()
+    output.flush()
+
+
+def _get_error_record(text, error):
+    errors = error.error_log.filter_from_errors()
+
+    if not errors:
+        return 0, str(error)
+
+    first = errors[0]
+    return fragments.get_offset(text, first.line, first.column), first.message
+
+
+class _ChunkedWriter:
+    """Collect the many small strings the C14N serializer writes into
+    larger chunks."""
+
+    def __init__(self, write):
+        self.chunks = []
+        self.size = 0
+        self.write_chunk = write
+
+    def write(self, text):
+        self.chunks.append(text)
+        self.size += len(text)
+
+        if self.size >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.chunks:
+            self.write_chunk("".join(self.chunks))
+            self.chunks = []
+            self.size = 0
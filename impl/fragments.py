@@ -0,0 +1,156 @@
+"""Split a buffer that holds many XML documents into the documents.
+
+Logs and message dumps often hold thousands of XML documents one after
+another, one per line or separated by blank lines or log prefixes. To format
+or check them, we need to know where each document begins and ends.
+
+A full tokenizer would be too slow for a buffer of a gigabyte, so the scanner
+only looks for the root element of each document and the end tag that closes
+it. Everything between the documents is left as it is. The scanner doesn't
+know about comments or CDATA sections inside the root element, so an end tag
+of the root element inside one of those ends the document early.
+
+Something that looks like a start tag but is never closed, like the
+"<init>" in a Java stack trace, is taken to be part of the text between the
+documents, unless there are no more documents after it."""
+
+import re
+
+# The number of documents a worker formats or checks at a time.
+BATCH_SIZE = 256
+
+# A prolog item or the start of a root element. A root element must start
+# with a name character, so that "a < b" or "<-" in a log isn't mistaken for
+# one.
+START = re.compile(r"""
+    <(?:
+        \?.*?\?>
+      | !--.*?-->
+      | !DOCTYPE(?:[^\[>]|\[.*?\])*>
+      | (?P<name>[^\W\d][\w.:-]*)
+    )
+""", re.S | re.X)
+
+# The rest of a start tag after the element name.
+TAG_REST = re.compile(r"""(?:[^>"']|"[^"]*"|'[^']*')*>""")
+
+_patterns = {}
+
+
+def split(text):
+    """Get a (begin, end) pair for every document in text.
+
+    A document begins at its first prolog item, if any, and ends at the end
+    tag of its root element. If the root element of the last document never
+    ends, the document extends to the end of text."""
+    spans = []
+    begin = None
+    unclosed = None
+    pos = 0
+
+    # The position after which there are no end tags for each element name,
+    # so that we don't look for them again.
+    endless = {}
+
+    while True:
+        match = START.search(text, pos)
+
+        if match is None:
+            break
+
+        if begin is None:
+            begin = match.start()
+
+        name = match.group("name")
+        pos = match.end()
+
+        if name is None:
+            continue
+
+        end = _find_end(text, name, pos, endless)
+
+        if end is None:
+            if unclosed is None:
+                unclosed = begin
+
+            begin = None
+            continue
+
+        spans.append((begin, end))
+        begin = None
+        unclosed = None
+        pos = end
+
+    if unclosed is not None:
+        spans.append((unclosed, len(text)))
+
+    return spans
+
+
+def get_offset(text, line, column):
+    """Get the offset in text of the given 1-based line and column."""
+    offset = 0
+
+    for _ in range(line - 1):
+        newline = text.find("\n", offset)
+
+        if newline == -1:
+            break
+
+        offset = newline + 1
+
+    return min(len(text), offset + max(0, column - 1))
+
+
+###########
+# PRIVATE #
+###########
+
+
+def _find_end(text, name, pos, endless):
+    """Find the end of the element whose name ends at pos, or get None if it
+    never ends."""
+    tag = TAG_REST.match(text, pos)
+
+    if tag is None:
+        return None
+
+    if text[tag.end() - 2] == "/":
+        return tag.end()
+
+    opening, closing = _get_patterns(name)
+    depth = 1
+    pos = tag.end()
+
+    while True:
+        if pos >= endless.get(name, len(text) + 1):
+            return None
+
+        close = closing.search(text, pos)
+
+        if close is None:
+            endless[name] = min(pos, endless.get(name, pos))
+            return None
+
+        # Elements with the same name as the root element nest.
+        depth += sum(1 for _ in opening.finditer(text, pos, close.start()))
+        depth -= 1
+        pos = close.end()
+
+        if depth == 0:
+            return pos
+
+
+def _get_patterns(name):
+    patterns = _patterns.get(name)
+
+    if patterns is None:
+        escaped = re.escape(name)
+
+        patterns = _patterns[name] = (
+            re.compile(r"""<%s(?:\s(?:[^>"']|"[^"]*"|'[^']*')*)?(?<!/)>"""
+                       % escaped),
+            re.compile(r"</%s\s*>" % escaped)
+        )
+
+    return patterns
@@ -0,0 +1,149 @@
+"""XInclude processing with a cache of the parsed included documents.
+
+A large modular document can include hundreds of files. Instead of parsing
+every one of them every time the document is validated, we keep the parsed
+included documents in memory and only parse a file again if its modification
+time or size has changed since we last parsed it."""
+
+import copy
+import os
+import threading
+import urllib.request as urllib
+
+from urllib.parse import urlparse
+
+from lxml import etree
+from lxml import ElementInclude
+
+import Exalt.exalt as exalt
+import Exalt.impl.parsetools as parsetools
+
+XINCLUDE_INCLUDE = ElementInclude.XINCLUDE_INCLUDE
+
+_cache_lock = threading.Lock()
+
+
+def has_includes(document):
+    """Check whether the document has any xi:include elements."""
+    return next(document.getroot().iter(XINCLUDE_INCLUDE), None) is not None
+
+
+def process(view, document, profile="validate"):
+    """Get a copy of the document with its XIncludes processed.
+
+    The included documents are parsed with the parser options of the given
+    profile. The document itself is left as it is, because it might be
+    shared via the parsed document cache."""
+    document = copy.deepcopy(document)
+    base_url = exalt.file_to_uri(view.file_name()) \
+        if view.file_name() else document.docinfo.URL
+
+    lines = [element.sourceline for element in _get_includes(document)]
+    loaded = []
+
+    def loader(href, parse, encoding=None):
+        node = load(href, parse, profile, encoding)
+
+        if parse == "xml":
+            loaded.append(node)
+
+        return node
+
+    ElementInclude.include(document, loader=loader, base_url=base_url,
+                           max_depth=None)
+
+    _attribute_to_includes(loaded, lines)
+    return document
+
+
+def load(href, parse, profile, encoding=None):
+    """Load the resource at href for an xi:include element.
+
+    Parsed XML documents on the local file system come from the include
+    cache if they haven't changed. Since the caller puts the element it gets
+    into another document, we always return a copy of the cached element."""
+    path = _get_path(href)
+
+    if parse != "xml":
+        return ElementInclude.default_loader(path or href, parse, encoding)
+    elif path is None:
+        return etree.parse(href).getroot()
+
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+
+    with _cache_lock:
+        entry = exalt.include_cache.get(path)
+
+    if entry is not None and entry[0] == stamp:
+        tree = entry[1]
+    else:
+        tree = _parse(path, profile)
+
+        with _cache_lock:
+            exalt.include_cache[path] = (stamp, tree)
+
+    return copy.deepcopy(tree.getroot())
+
+
+###########
+# PRIVATE #
+###########
+
+
+def _get_path(href):
+    """Get the local file system path of href, or None if href isn't a local
+    file."""
+    url = urlparse(href)
+
+    if url.scheme == "file":
+        return urllib.url2pathname(url.path)
+    elif not url.scheme or os.path.isabs(href):
+        return href
+    else:
+        return None
+
+
+def _get_includes(document):
+    """Get the xi:include elements of the document that include XML and
+    aren't in the fallback of another xi:include."""
+    return [element for element in document.iter(XINCLUDE_INCLUDE)
+            if element.get("parse", "xml") == "xml" and
+            next(element.iterancestors(XINCLUDE_INCLUDE), None) is None]
+
+
+def _attribute_to_includes(loaded, lines):
+    """Move the included elements to the line of the xi:include element that
+    includes them, directly or via other included files.
+
+    The line numbers of included elements are line numbers in the included
+    files, so validation errors in included content would point at unrelated
+    lines of the document that includes them.
+
+    ElementInclude loads the xi:include elements of the document in document
+    order, and the xi:include elements of each included document right after
+    the document itself, so the included elements that aren't inside other
+    included elements are in the same order as the xi:include elements."""
+    nodes = set(loaded)
+    outermost = [node for node in loaded
+                 if not any(ancestor in nodes
+                            for ancestor in node.iterancestors())]
+
+    if len(outermost) != len(lines):
+        return
+
+    for node, line in zip(outermost, lines):
+        if line is None:
+            continue
+
+        for element in node.iter():
+            element.sourceline = line
+
+
+def _parse(path, profile):
+    # Included files declare their own encoding.
+    options = dict(parsetools.PROFILES[profile])
+    options.pop("encoding", None)
+
+    with parsetools.pooled_parser_for("xml", **options) as parser:
+        return parsetools.parse_file(parser, path)
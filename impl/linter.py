@@ -0,0 +1,670 @@
+"""Incremental well-formedness checking for XML documents.
+
+The linter splits the document into segments that start at token boundaries
+roughly every N characters. Each segment remembers the elements that are open
+at its start, so after an edit we only need to rescan from the last segment
+that starts before the edit up to the first segment boundary after the edit
+where the scanner is in the same state as it was before the edit. Everything
+after that point is reused as is.
+
+Each segment also records the tags in it, so the linter doubles as an index
+of the elements and IDs in the document. The elements of a segment are only
+collected once, so after an edit, only the segments that were rescanned are
+collected again. See Outline."""
+
+import bisect
+import re
+
+import Exalt.messages as messages
+
+NAME = r"[^\s!\"#$%&'()*+,/;<=>?@\[\\\]^`{|}~]+"
+
+TOKEN = re.compile(r"""
+    (?P<text>[^<&]+)
+  | <(?P<start>{name})(?P<attributes>(?:\s+{name}\s*=\s*
+        (?:"[^<"]*"|'[^<']*'))*)\s*(?P<empty>/?)>
+  | </(?P<end>{name})\s*>
+  | &(?:{name}|\#[0-9]+|\#x[0-9a-fA-F]+);
+  | <!--.*?-->
+  | <!\[CDATA\[.*?\]\]>
+  | <\?.*?\?>
+  | <!DOCTYPE(?:[^\[>]|\[.*?\])*>
+""".format(name=NAME), re.S | re.X)
+
+ID = re.compile(r"""(?:^|\s)(?:xml:)?id\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+
+START = 0
+EMPTY = 1
+END = 2
+
+CHUNK_SIZE = 4096
+
+
+class OpenTag:
+    """An element whose start tag we've seen but whose end tag we haven't.
+
+    Open tags form a linked list from the innermost open element to the
+    root, so every segment can share the tags that are open at its start
+    with the segment before it."""
+    __slots__ = ("name", "start", "parent")
+
+    def __init__(self, name, start, parent):
+        self.name = name
+        self.start = start
+        self.parent = parent
+
+
+class Segment:
+    """A stretch of the document that starts at a token boundary.
+
+    The positions of the errors in a segment are relative to the start of
+    the segment so that moving a segment is cheap. The same goes for the
+    (kind, begin, end, name, id) records of the tags in the segment.
+
+    The reach of a segment is how far the scanner had to look to tokenize
+    it. An unterminated comment, for instance, makes the scanner look all
+    the way to the end of the document.
+
+    The elements of the segment are collected into a _Part the first time an
+    Outline needs them."""
+    __slots__ = ("start", "stack", "after_root", "errors", "tags", "reach",
+                 "part")
+
+    def __init__(self, start, stack, after_root):
+        self.start = start
+        self.stack = stack
+        self.after_root = after_root
+        self.errors = []
+        self.tags = []
+        self.reach = start
+        self.part = None
+
+
+class Linter:
+    """Check the well-formedness of a single document."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.text = ""
+        self.segments = []
+        self._outline = None
+
+    def update(self, text):
+        """Check text, rescanning only the parts that changed since the last
+        time this method was called."""
+        if not self.segments:
+            self.text = text
+            self.segments = self._scan(text, Segment(0, None, False))
+            self._outline = None
+            return
+
+        begin, old_end, new_end = diff(self.text, text)
+        delta = new_end - old_end
+
+        if begin == old_end == new_end:
+            return
+
+        self._outline = None
+
+        old = self.segments
+        starts = [segment.start for segment in old]
+        k = max(0, bisect.bisect_left(starts, begin) - 1)
+        j = bisect.bisect_left(starts, old_end, k + 1)
+
+        for i in range(k):
+            if old[i].reach >= begin:
+                k = i
+                break
+
+        start = old[k]
+        candidates = [(old[i].start + delta, i) for i in range(j, len(old))]
+        resumed = Segment(start.start, start.stack, start.after_root)
+        scanned = self._scan(text, resumed,
+                             _Convergence(candidates, old, old_end, delta))
+
+        converged = scanned.converged_at
+
+        if converged is not None:
+            _shift(old[converged:], old_end, delta)
+            scanned.extend(old[converged:])
+
+        self.text = text
+        self.segments = old[:k] + scanned
+
+    def errors(self):
+        """Get a (point, message) record for every error in the document."""
+        return [(segment.start + offset, message)
+                for segment in self.segments
+                for offset, message in segment.errors]
+
+    def outline(self):
+        """Get the Outline of the document.
+
+        The outline is only put together again if the document has changed
+        since the last time, and then only the elements of the segments
+        that were rescanned are collected again."""
+        if self._outline is None:
+            self._outline = Outline(self.segments, len(self.text))
+
+        return self._outline
+
+    def _scan(self, text, segment, convergence=None):
+        segments = _Segments([segment])
+        stack = segment.stack
+        after_root = segment.after_root
+        pos = segment.start
+        end = len(text)
+
+        def error(point, message):
+            segment.errors.append((point - segment.start, message))
+
+        def tag(kind, match, name, id=None):
+            segment.tags.append((kind,
+                                 match.start() - segment.start,
+                                 match.end() - segment.start,
+                                 name,
+                                 id))
+
+        while pos < end:
+            if convergence is not None and pos >= convergence.position:
+                i = convergence.at(pos, stack, after_root)
+
+                if i is not None:
+                    segments.converged_at = i
+                    return segments
+
+            if pos - segment.start >= self.interval:
+                segment = Segment(pos, stack, after_root)
+                segments.append(segment)
+
+            match = TOKEN.match(text, pos)
+
+            if match is None:
+                # The regular expression might have looked for the end of
+                # a comment or a CDATA section all the way to the end of
+                # the document.
+                segment.reach = end
+
+                if text[pos] == "<":
+                    error(pos, messages.LINT_INVALID_MARKUP)
+                    next_tag = text.find("<", pos + 1)
+                    pos = end if next_tag == -1 else next_tag
+                else:
+                    error(pos, messages.LINT_INVALID_REFERENCE)
+                    pos += 1
+                continue
+
+            kind = match.lastgroup
+
+            if kind == "text":
+                if stack is None and match.group().strip():
+                    error(pos, messages.LINT_CONTENT_OUTSIDE_ROOT)
+            elif kind == "start" or kind == "attributes" or kind == "empty":
+                if stack is None and after_root:
+                    error(pos, messages.LINT_EXTRA_CONTENT)
+
+                name = match.group("start")
+                attributes = match.group("attributes")
+                id = _get_id(attributes) if attributes else None
+
+                if match.group("empty"):
+                    tag(EMPTY, match, name, id)
+                    after_root = after_root or stack is None
+                else:
+                    tag(START, match, name, id)
+                    stack = OpenTag(name, pos, stack)
+            elif kind == "end":
+                name = match.group("end")
+                tag(END, match, name)
+
+                if stack is None:
+                    error(pos, messages.LINT_UNEXPECTED_END_TAG % name)
+                elif stack.name == name:
+                    stack = stack.parent
+                    after_root = after_root or stack is None
+                else:
+                    error(pos, messages.LINT_TAG_MISMATCH % (stack.name,
+                                                             name))
+                    stack = _close(stack, name)
+                    after_root = after_root or stack is None
+
+            pos = match.end()
+            segment.reach = max(segment.reach, pos + 1)
+
+        while stack is not None:
+            error(end, messages.LINT_UNCLOSED_TAG % stack.name)
+            stack = stack.parent
+
+        if not after_root:
+            error(end, messages.LINT_NO_ROOT)
+
+        return segments
+
+
+class Outline:
+    """The elements of a document in document order.
+
+    Element i is the ith start tag or empty-element tag in the document. The
+    elements are kept in one _Part per segment of the linter, with positions
+    relative to the start of the segment, so the parts of the segments an
+    edit didn't touch are reused as they are.
+
+    An outline is a snapshot: it doesn't change when the linter is updated
+    afterwards."""
+
+    def __init__(self, segments, size):
+        self.size = size
+        self.bases = []
+        self.parts = []
+        self.offsets = []
+        self.count = 0
+
+        for segment in segments:
+            if segment.part is None:
+                segment.part = _Part(segment)
+
+            self.bases.append(segment.start)
+            self.parts.append(segment.part)
+            self.offsets.append(self.count)
+            self.count += len(segment.part.starts)
+
+        self._labels = None
+        self._ids = None
+
+    def __len__(self):
+        return self.count
+
+    def name(self, i):
+        s, j = self._locate(i)
+        return self.parts[s].labels[j][0]
+
+    def get_path(self, i):
+        """Get the names of element i and its ancestors as a path."""
+        s, j = self._locate(i)
+        return self.parts[s].labels[j][1]
+
+    def start(self, i):
+        s, j = self._locate(i)
+        return self.bases[s] + self.parts[s].starts[j]
+
+    def end(self, i):
+        return self._end(*self._locate(i))
+
+    def labels(self):
+        """Get a [name, path] pair for every element."""
+        if self._labels is None:
+            self._labels = [label for part in self.parts
+                            for label in part.labels]
+
+        return self._labels
+
+    def ids(self):
+        """Get a dict that maps the id and xml:id attribute values in the
+        document to the first element that has them."""
+        if self._ids is None:
+            self._ids = {}
+
+            for offset, part in zip(self.offsets, self.parts):
+                for id, j in part.ids.items():
+                    self._ids.setdefault(id, offset + j)
+
+        return self._ids
+
+    def enclosing(self, begin, end):
+        """Get the innermost element that encloses the region between begin
+        and end and isn't the same as the region, or None if there's no
+        such element."""
+        s = bisect.bisect_right(self.bases, begin) - 1
+
+        if s < 0:
+            return None
+
+        part = self.parts[s]
+        j = bisect.bisect_right(part.starts, begin - self.bases[s]) - 1
+
+        # Every element that encloses the region starts before the region,
+        # so it's either the element that starts last before the region or
+        # one of its ancestors.
+        if j >= 0:
+            element = (s, j)
+        else:
+            element = self._owner(s, 0) if part.depth else None
+
+        while element is not None:
+            s, j = element
+
+            if self._encloses(s, j, begin, end):
+                return self.offsets[s] + j
+
+            element = self._parent(s, j)
+
+        return None
+
+    def _locate(self, i):
+        """Get the segment element i is in and its index in the segment."""
+        s = bisect.bisect_right(self.offsets, i) - 1
+        return s, i - self.offsets[s]
+
+    def _encloses(self, s, j, begin, end):
+        start = self.bases[s] + self.parts[s].starts[j]
+        stop = self._end(s, j)
+
+        # A cursor right after an element isn't in the element.
+        if begin == end == stop:
+            return False
+
+        return start <= begin and end <= stop and (start, stop) != (begin, end)
+
+    def _end(self, s, j):
+        part = self.parts[s]
+
+        if part.ends[j] is not None:
+            return self.bases[s] + part.ends[j]
+
+        # Follow the element through the stacks of the segments after it
+        # until one of them closes it.
+        depth = len(part.open) - 1 - part.open.index(j)
+
+        for s in range(s + 1, len(self.parts)):
+            part = self.parts[s]
+
+            if depth < len(part.closes):
+                return self.bases[s] + part.closes[depth]
+
+            depth += len(part.open) - len(part.closes)
+
+        return self.size
+
+    def _parent(self, s, j):
+        parent = self.parts[s].parents[j]
+
+        if parent is None:
+            return None
+        elif parent >= 0:
+            return s, parent
+        else:
+            return self._owner(s, -1 - parent)
+
+    def _owner(self, s, depth):
+        """Find the element that's at the given depth of the stack of
+        elements open at the start of segment s, innermost first."""
+        for s in range(s - 1, -1, -1):
+            part = self.parts[s]
+
+            if depth < len(part.open):
+                return s, part.open[-1 - depth]
+
+            depth += len(part.closes) - len(part.open)
+
+        return None
+
+
+class _Part:
+    """The elements of a segment.
+
+    starts, ends and parents are parallel lists. An element whose end isn't
+    in the segment has None as its end. The parent of an element is either
+    the index of an element in the segment or, if it's negative, -1 - depth,
+    where depth is the position of the parent in the stack of elements open
+    at the start of the segment. labels has a [name, path] pair for each
+    element.
+
+    closes has the end of each element that was open at the start of the
+    segment and that the segment closes, innermost first, and open has the
+    elements of the segment that are still open at its end, outermost
+    first. Those are all an outline needs to follow elements from one
+    segment to the next."""
+    __slots__ = ("starts", "ends", "parents", "labels", "ids", "depth",
+                 "closes", "open")
+
+    def __init__(self, segment):
+        self.starts = []
+        self.ends = []
+        self.parents = []
+        self.labels = []
+        self.ids = {}
+        self.closes = []
+
+        incoming = []
+        tag = segment.stack
+
+        while tag is not None:
+            incoming.append(tag.name)
+            tag = tag.parent
+
+        self.depth = len(incoming)
+
+        stack = []
+        closed = 0
+        paths = {}
+
+        for kind, begin, end, name, id in segment.tags:
+            if kind == END:
+                closed = self._close(stack, incoming, closed, name, begin, end)
+                continue
+
+            if stack:
+                parent = stack[-1]
+                path = self.labels[parent][1]
+            elif closed < len(incoming):
+                parent = -1 - closed
+
+                if closed not in paths:
+                    paths[closed] = "/" + "/".join(reversed(incoming[closed:]))
+
+                path = paths[closed]
+            else:
+                parent = None
+                path = ""
+
+            i = len(self.starts)
+            self.starts.append(begin)
+            self.ends.append(end if kind == EMPTY else None)
+            self.parents.append(parent)
+            self.labels.append([name, path + "/" + name])
+
+            if id is not None:
+                self.ids.setdefault(id, i)
+
+            if kind == START:
+                stack.append(i)
+
+        self.open = stack
+
+    def _close(self, stack, incoming, closed, name, begin, end):
+        """Close the innermost open element called name and get the number of
+        elements open at the start of the segment that are closed now.
+
+        Any elements inside it that weren't closed end where the end tag
+        begins. If no element called name is open, do nothing, like the
+        linter does."""
+        for depth in range(len(stack) - 1, -1, -1):
+            if self.labels[stack[depth]][0] == name:
+                while len(stack) > depth + 1:
+                    self.ends[stack.pop()] = begin
+
+                self.ends[stack.pop()] = end
+                return closed
+
+        try:
+            depth = incoming.index(name, closed)
+        except ValueError:
+            return closed
+
+        while stack:
+            self.ends[stack.pop()] = begin
+
+        self.closes.extend([begin] * (depth - closed))
+        self.closes.append(end)
+        return depth + 1
+
+
+class _Segments(list):
+    converged_at = None
+
+
+class _Convergence:
+    """The segment boundaries after an edit where rescanning can stop."""
+
+    def __init__(self, candidates, segments, old_end, delta):
+        self.candidates = candidates
+        self.segments = segments
+        self.old_end = old_end
+        self.delta = delta
+        self.i = 0
+        self._advance(0)
+
+    def _advance(self, pos):
+        candidates = self.candidates
+
+        while self.i < len(candidates) and candidates[self.i][0] < pos:
+            self.i += 1
+
+        if self.i < len(candidates):
+            self.position = candidates[self.i][0]
+        else:
+            self.position = float("inf")
+
+    def at(self, pos, stack, after_root):
+        """If the scanner state at pos matches the state the scanner was in
+        at the same point before the edit, get the index of the old segment
+        that starts at pos."""
+        self._advance(pos)
+
+        if self.position != pos:
+            return None
+
+        index = self.candidates[self.i][1]
+        segment = self.segments[index]
+
+        if segment.after_root == after_root and \
+           self._same_stack(stack, segment.stack):
+            return index
+
+        return None
+
+    def _same_stack(self, new, old):
+        while new is not old:
+            if new is None or old is None or new.name != old.name:
+                return False
+
+            start = old.start + self.delta \
+                if old.start >= self.old_end else old.start
+
+            if new.start != start:
+                return False
+
+            new = new.parent
+            old = old.parent
+
+        return True
+
+
+def _get_id(attributes):
+    match = ID.search(attributes)
+
+    if match is None:
+        return None
+
+    return match.group(1) if match.group(1) is not None else match.group(2)
+
+
+def _close(stack, name):
+    """Close the innermost open element called name.
+
+    If there's no such element, leave the stack as it is."""
+    tag = stack
+
+    while tag is not None:
+        if tag.name == name:
+            return tag.parent
+
+        tag = tag.parent
+
+    return stack
+
+
+def _shift(segments, old_end, delta):
+    """Move the given segments and the elements open at their start by
+    delta."""
+    if delta == 0:
+        return
+
+    shifted = set()
+
+    for segment in segments:
+        segment.start += delta
+        segment.reach += delta
+        tag = segment.stack
+
+        while tag is not None and tag.start >= old_end and \
+                id(tag) not in shifted:
+            tag.start += delta
+            shifted.add(id(tag))
+            tag = tag.parent
+
+
+def common_prefix(a, b):
+    """Get the length of the common prefix of a and b.
+
+    Comparing slices happens in C, so we compare increasingly large chunks
+    and only bisect the chunk that differs."""
+    limit = min(len(a), len(b))
+    lo = 0
+    step = CHUNK_SIZE
+
+    while lo < limit:
+        hi = min(lo + step, limit)
+
+        if a[lo:hi] != b[lo:hi]:
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+
+                if a[lo:mid] == b[lo:mid]:
+                    lo = mid
+                else:
+                    hi = mid
+
+            return lo
+
+        lo = hi
+        step *= 2
+
+    return limit
+
+
+def common_suffix(a, b, limit):
+    """Get the length of the common suffix of a and b, up to limit."""
+    la = len(a)
+    lb = len(b)
+    lo = 0
+    step = CHUNK_SIZE
+
+    while lo < limit:
+        hi = min(lo + step, limit)
+
+        if a[la - hi:la - lo] != b[lb - hi:lb - lo]:
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+
+                if a[la - mid:la - lo] == b[lb - mid:lb - lo]:
+                    lo = mid
+                else:
+                    hi = mid
+
+            return lo
+
+        lo = hi
+        step *= 2
+
+    return limit
+
+
+def diff(old, new):
+    """Get the region that changed between old and new.
+
+    Returns a (begin, old_end, new_end) tuple, where old[begin:old_end] is the
+    text that was replaced by new[begin:new_end]."""
+    begin = common_prefix(old, new)
+    suffix = common_suffix(old, new, min(len(old), len(new)) - begin)
+    return begin, len(old) - suffix, len(new) - suffix
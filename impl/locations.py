@@ -0,0 +1,94 @@
+"""Find where the elements that validation errors are about begin.
+
+Schema validation errors only tell the line of the element they're about.
+That's good enough for documents with one element per line, but in a
+minified document the whole document is on one line, so every error points
+at the beginning of the document.
+
+libxml2 does tell the path of the element, though. To find where the element
+begins in the text, we number the elements of the parsed document in document
+order and look up the start tag with the same number in the text. We only
+scan the text for start tags the first time we need to, which is the first
+time an error is on a long line."""
+
+import re
+
+from lxml import etree
+
+# A start tag, or markup that can contain something that looks like one.
+TOKEN = re.compile(r"""
+    <!--.*?-->
+  | <!\[CDATA\[.*?\]\]>
+  | <\?.*?\?>
+  | <!DOCTYPE(?:[^\[>]|\[.*?\])*>
+  | (?P<start><)[^\s/>!?]
+""", re.S | re.X)
+
+
+class Locator:
+    """Find the elements of a parsed document in the text they were parsed
+    from.
+
+    The text argument is a function that gets the text, so that we don't copy
+    the contents of the view unless we need them."""
+
+    def __init__(self, document, text):
+        self.document = document
+        self.text = text
+        self.starts = None
+        self.order = None
+
+    def locate(self, error):
+        """Get the offset of the start tag of the element an lxml error is
+        about, or None if we can't find it."""
+        return self.locate_path(getattr(error, "path", None))
+
+    def locate_path(self, path):
+        """Get the offset of the start tag of the element at the given XPath
+        path, or None if we can't find it."""
+        if not path:
+            return None
+
+        try:
+            nodes = self.document.xpath(path, namespaces=self._get_prefixes())
+        except (etree.XPathError, TypeError):
+            return None
+
+        if not isinstance(nodes, list) or not nodes or \
+           not isinstance(nodes[0], etree._Element):
+            return None
+
+        self._index()
+        position = self.order.get(nodes[0])
+
+        return self.starts[position] if position is not None else None
+
+    def _index(self):
+        if self.starts is not None:
+            return
+
+        self.starts = get_start_tags(self.text())
+        self.order = {}
+
+        elements = (node for node in self.document.iter()
+                    if isinstance(node.tag, str))
+
+        for position, element in enumerate(elements):
+            self.order[element] = position
+
+        # Elements that come from entities or XIncludes have no start tags
+        # of their own, so the numbers wouldn't match.
+        if len(self.order) != len(self.starts):
+            self.order = {}
+
+    def _get_prefixes(self):
+        root = self.document.getroot() \
+            if hasattr(self.document, "getroot") else self.document
+
+        return {prefix: uri for prefix, uri in root.nsmap.items() if prefix}
+
+
+def get_start_tags(text):
+    """Get the offsets of all start tags in text, in document order."""
+    return [match.start() for match in TOKEN.finditer(text)
+            if match.group("start")]
@@ -1,18 +1,145 @@
+import mmap
+import os
+import threading
+
 import Exalt.view as vu
 import Exalt.messages as messages
+import Exalt.encodings as encodings
+import Exalt.settings as settings
 import Exalt.exalt as exalt
 import Exalt.utils as utils
 
+from contextlib import contextmanager
+
 from lxml import etree
 
+# The parser options each command uses.
+PROFILES = {
+    "wellformed": {
+        "encoding": encodings.UTF8
+    },
+    "validate": {
+        "encoding": encodings.UTF8,
+        "load_dtd": True
+    },
+    "format": {
+        "encoding": encodings.UTF8,
+        "remove_blank_text": True,
+        "recover": True
+    },
+    "canonicalize": {
+        "encoding": encodings.UTF8,
+        "remove_blank_text": True
+    }
+}
 
-def get_parser(view, **kwargs):
+# The parser options for documents larger than the large_document_size
+# setting.
+#
+# libxml2 refuses to parse very deeply nested documents and very long text
+# nodes unless huge_tree is on. Only the validate profile collects IDs,
+# because DTD validation needs them to check ID references.
+LARGE_PROFILES = {
+    "wellformed": {
+        "encoding": encodings.UTF8,
+        "huge_tree": True,
+        "collect_ids": False
+    },
+    "validate": {
+        "encoding": encodings.UTF8,
+        "load_dtd": True,
+        "huge_tree": True
+    },
+    "format": {
+        "encoding": encodings.UTF8,
+        "remove_blank_text": True,
+        "recover": True,
+        "huge_tree": True,
+        "collect_ids": False
+    },
+    "canonicalize": {
+        "encoding": encodings.UTF8,
+        "remove_blank_text": True,
+        "huge_tree": True,
+        "collect_ids": False
+    }
+}
+
+PARSERS = {
+    "xml": etree.XMLParser,
+    "html": etree.HTMLParser
+}
+
+# The maximum number of idle parsers per thread for each set of options.
+POOL_SIZE = 2
+
+_pool = threading.local()
+
+# Documents are parsed on several threads at once, so only one thread at a
+# time may touch the document cache.
+_cache_lock = threading.Lock()
+
+
+def get_parser_kind(view):
     if vu.is_xml(view):
-        return etree.XMLParser(**kwargs)
+        return "xml"
     elif vu.is_html(view):
-        return etree.HTMLParser(**kwargs)
+        return "html"
     else:
-        raise Exception(messages.NO_PARSER_FOR_SYNTAX % exalt.get_syntax(view))
+        raise Exception(messages.NO_PARSER_FOR_SYNTAX % vu.get_syntax(view))
+
+
+def get_parser(view, **kwargs):
+    return PARSERS[get_parser_kind(view)](**kwargs)
+
+
+def is_large(view):
+    """Check whether the document in the view is large enough to need the
+    large document profiles."""
+    threshold = exalt.get_setting(settings.LARGE_DOCUMENT_SIZE, 10000000)
+    return view.size() > threshold
+
+
+def get_options(view, profile):
+    """Get the parser options of the given profile for the document in the
+    view."""
+    profiles = LARGE_PROFILES if is_large(view) else PROFILES
+    return dict(profiles[profile])
+
+
+@contextmanager
+def pooled_parser(view, **kwargs):
+    """Check out a parser for the view from the parser pool.
+
+    Setting up a parser is not free, so instead of making a new parser every
+    time, we keep the parsers we've made in a pool, keyed by the kind of the
+    parser and its options. Every thread has a pool of its own, because
+    lxml parsers must not be used by more than one thread at a time.
+
+    lxml clears the error log of a parser whenever it starts parsing
+    something, so read the error log before the parser goes back to the
+    pool."""
+    with pooled_parser_for(get_parser_kind(view), **kwargs) as parser:
+        yield parser
+
+
+@contextmanager
+def pooled_parser_for(kind, **kwargs):
+    """Check out a parser of the given kind ("xml" or "html") from the
+    parser pool."""
+    key = (kind, tuple(sorted(kwargs.items())))
+
+    if not hasattr(_pool, "parsers"):
+        _pool.parsers = {}
+
+    idle = _pool.parsers.setdefault(key, [])
+    parser = idle.pop() if idle else PARSERS[kind](**kwargs)
+
+    try:
+        yield parser
+    finally:
+        if len(idle) < POOL_SIZE:
+            idle.append(parser)
 
 
 def parse_string(view, parser, string):
@@ -20,3 +147,138 @@ def parse_string(view, parser, string):
         return etree.parse(utils.string_to_bytes(string), parser)
     else:
         raise Exception(messages.CANNOT_PARSE_EXCEPTION)
+
+
+def parse_file(parser, path):
+    """Parse the file at the given path.
+
+    The parser reads the file through a read-only memory map, so the
+    contents of the file are never copied into a Python string. The file is
+    decoded according to its own encoding declaration."""
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return etree.parse(buffer, parser,
+                               base_url=exalt.file_to_uri(path))
+
+
+def parse_region(view, profile, region):
+    """Parse the given region of the view with the parser options of the
+    given profile."""
+    with pooled_parser(view, **get_options(view, profile)) as parser:
+        return parse_string(view, parser, view.substr(region))
+
+
+def parse_view(view, profile, from_file=False):
+    """Parse the entire document in the view with the parser options of the
+    given profile.
+
+    If from_file is True and the view has no unsaved changes, parse the
+    file on disk instead of the contents of the view.
+
+    Parsed documents are cached until the view changes, so that running
+    several commands on an unchanged view only parses it once. The trees in
+    the cache are shared, so if you need to modify the tree you get, modify
+    a copy of it instead.
+
+    Large documents are never cached, so their trees are freed as soon as
+    the caller is done with them."""
+    change_count = view.change_count()
+    tree = _get_cached_document(view, profile, change_count)
+
+    if tree is not None:
+        return tree
+
+    large = is_large(view)
+    options = get_options(view, profile)
+    path = view.file_name()
+
+    if from_file and not view.is_dirty() and _is_nonempty_file(path):
+        # The file declares its own encoding, so don't override it.
+        options.pop("encoding", None)
+
+        with pooled_parser(view, **options) as parser:
+            tree = parse_file(parser, path)
+            clean = len(parser.error_log.filter_from_errors()) == 0
+    else:
+        with pooled_parser(view, **options) as parser:
+            tree = parse_string(view, parser, vu.get_content(view))
+
+            # If the parser had to recover from errors, the tree is only
+            # good for profiles that allow recovering.
+            clean = len(parser.error_log.filter_from_errors()) == 0
+
+    if not large:
+        _cache_document(view, profile, change_count, tree, clean)
+
+    return tree
+
+
+def forget_documents(view):
+    """Drop the cached parsed documents of the view."""
+    with _cache_lock:
+        for key in list(exalt.document_cache.keys()):
+            if key[0] == view.id():
+                del exalt.document_cache[key]
+
+
+###########
+# PRIVATE #
+###########
+
+
+def _is_nonempty_file(path):
+    # You can't memory-map an empty file.
+    return path is not None and os.path.isfile(path) and \
+        os.path.getsize(path) > 0
+
+
+def _options_key(profile):
+    """Get the parser options of the profile, ignoring the recover option.
+
+    If a parser that doesn't recover from errors manages to parse a
+    document, it yields the same tree as a parser that does."""
+    options = PROFILES[profile]
+
+    return tuple(sorted((key, value) for key, value in options.items()
+                        if key != "recover"))
+
+
+def _get_cached_document(view, profile, change_count):
+    key = _options_key(profile)
+    recover = PROFILES[profile].get("recover", False)
+
+    with _cache_lock:
+        for cache_key, entry in list(exalt.document_cache.items()):
+            view_id, cached_profile = cache_key
+            cached_change_count, tree, clean, _ = entry
+
+            if view_id == view.id() and \
+               cached_change_count == change_count and \
+               _options_key(cached_profile) == key and \
+               (clean or recover):
+                exalt.document_cache.move_to_end(cache_key)
+                return tree
+
+    return None
+
+
+def _cache_document(view, profile, change_count, tree, clean):
+    max_size = exalt.get_setting(settings.DOCUMENT_CACHE_MAX_SIZE, 0)
+    size = view.size()
+
+    if size > max_size:
+        return
+
+    with _cache_lock:
+        exalt.document_cache[(view.id(), profile)] = (change_count,
+                                                      tree,
+                                                      clean,
+                                                      size)
+
+        # Keep the total size of the cached documents under the limit by
+        # dropping the least recently used documents.
+        total = sum(entry[3] for entry in exalt.document_cache.values())
+
+        while total > max_size:
+            _, entry = exalt.document_cache.popitem(last=False)
+            total -= entry[3]
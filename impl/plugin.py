@@ -1,43 +1,561 @@
 """This module implements a Sublime Text 3 plugin for formatting and validating
 XML and HTML markup."""
 
+import importlib
 import os
+import sys
+import threading
+import time
+import traceback
 import sublime
 import sublime_api
+import sublime_plugin
 
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from sublime_plugin import TextCommand, EventListener
 
-import Exalt.encodings as encodings
 import Exalt.constants as constants
+import Exalt.messages as messages
 import Exalt.exalt as exalt
 import Exalt.settings as settings
 import Exalt.view as vu
 
-# XML_CATALOG_FILES needs to be set *before* lxml is loaded:
-# http://permalink.gmane.org/gmane.comp.python.lxml.devel/7501
-os.environ["XML_CATALOG_FILES"] = " ".join(
-    exalt.get_catalog_files(
-        exalt.get_setting(settings.XML_CATALOG_FILES)
-    )
+import Exalt.impl.completions as completions
+import Exalt.impl.fragments as fragments
+import Exalt.impl.linter as linter
+import Exalt.impl.scheduler as scheduler
+import Exalt.impl.dependencies as dependencies
+import Exalt.impl.associations as associations
+
+# lxml and the modules that use it are loaded on first use. See load().
+etree = None
+parsetools = None
+validator = None
+formatter = None
+includes = None
+xpath = None
+transform = None
+
+queue = scheduler.Scheduler(
+    lambda: exalt.get_setting(settings.VALIDATION_CONCURRENCY, 2)
 )
 
-# lxml is delivered as a Package Control dependency.
-#
-# See https://packagecontrol.io/docs/dependencies.
-from lxml import etree
-from lxml import isoschematron
+DEPENDENTS_PANEL = "exalt_dependents"
+
+dependency_index = None
+dependency_index_lock = threading.Lock()
+executor = None
+
+# Linters are updated both on the async thread and on the validation workers.
+linter_lock = threading.Lock()
+
+# Every XPath query gets a number. Starting a new query or cancelling the
+# current one makes the results of the earlier queries obsolete.
+xpath_query = 0
+xpath_expression = ""
+
+# The last stylesheet and source document the user transformed with.
+last_stylesheet = ""
+last_source = ""
+
+# The documents exalt_format_fragments has formatted for each view, waiting
+# to be put into the view on the UI thread.
+formatted_fragments = {}
+
+# The IDs of the views whose viewport we're watching for scrolling.
+watched_viewports = set()
+
+# The syntax of the result view for each XSLT output method.
+RESULT_SYNTAXES = {
+    "xml": "Packages/XML/XML.sublime-syntax",
+    "html": "Packages/HTML/HTML.sublime-syntax",
+    "text": "Packages/Text/Plain text.tmLanguage"
+}
+
+
+def load():
+    """Load lxml and the modules that depend on it.
+
+    Importing lxml takes a while, so we only do it the first time an XML or
+    HTML file needs validating or an Exalt command needs lxml, instead of
+    every time Sublime Text starts."""
+    global etree, parsetools, validator, formatter, includes, xpath, transform
+
+    if transform is not None:
+        return
+
+    # XML_CATALOG_FILES needs to be set *before* lxml is loaded:
+    # http://permalink.gmane.org/gmane.comp.python.lxml.devel/7501
+    os.environ["XML_CATALOG_FILES"] = " ".join(
+        exalt.get_catalog_files(
+            exalt.get_setting(settings.XML_CATALOG_FILES)
+        )
+    )
+
+    # lxml is delivered as a Package Control dependency.
+    #
+    # See https://packagecontrol.io/docs/dependencies.
+    etree = exalt.measure("lxml.etree", importlib.import_module, "lxml.etree")
+
+    parsetools = _load_module("%s.impl.parsetools" % constants.PLUGIN_NAME)
+    validator = _load_module("%s.impl.validator" % constants.PLUGIN_NAME)
+    formatter = _load_module("%s.impl.formatter" % constants.PLUGIN_NAME)
+    includes = _load_module("%s.impl.includes" % constants.PLUGIN_NAME)
+    xpath = _load_module("%s.impl.xpath" % constants.PLUGIN_NAME)
+    transform = _load_module("%s.impl.transform" % constants.PLUGIN_NAME)
+
+
+def _load_module(name):
+    return exalt.measure(name, _reload_module, name)
+
+
+def _reload_module(name):
+    # Reload the module in case we're reloading the plugin.
+    sublime_plugin.reload_plugin(name)
+    return sys.modules[name]
+
+
+def validate_view(view, lean=False):
+    """Parse the document in the view and validate it.
+
+    If lean is True and the document is large, only check that the document
+    is well-formed and leave validating it against a schema for when the
+    user saves the file or runs the validate command.
+
+    Runs on one of the worker threads of the validation queue."""
+    if not view.is_valid():
+        return
+
+    large = parsetools.is_large(view)
+    vu.show_mode(view, large)
+
+    profile = "wellformed" if large and lean else "validate"
+
+    try:
+        doc = parsetools.parse_view(view, profile, from_file=True)
+    except etree.XMLSyntaxError as e:
+        message = str(e)
+
+        if constants.LXML_NO_DTD_FOUND not in message:
+            errors = e.error_log.filter_from_errors()
+            vu.show_errors(view, message, errors, syntax=True)
+
+        return
+
+    if profile == "wellformed":
+        validator.declare_well_formed(view)
+        return
+
+    if exalt.get_setting(settings.PROCESS_XINCLUDE, False) and \
+       includes.has_includes(doc):
+        try:
+            doc = includes.process(view, doc)
+        except (etree.LxmlError, OSError) as e:
+            vu.show_error(view, messages.XINCLUDE_ERROR % e)
+            return
+
+    validate_document(view, doc)
+
+
+def find_association(view):
+    """Find the schema association rule that matches the document in the
+    view by looking at the prolog of the document only."""
+    index = exalt.association_index
+
+    if not index:
+        return None
+
+    prolog = view.substr(sublime.Region(0, associations.PROLOG_SIZE))
+    return index.find(view.file_name(), associations.scan(prolog))
+
+
+def validate_document(view, doc):
+    association = find_association(view)
+
+    if association is not None:
+        validator.validate_against_association(view, doc, association)
+    elif vu.is_xslt(view):
+        validator.validate_xslt(view, doc)
+    else:
+        validator.try_validate(view, doc)
+
+    exalt.measure_since_load(messages.FIRST_VALIDATION)
+
+
+def get_dependency_index():
+    global dependency_index
+
+    extensions = tuple(exalt.get_setting(settings.DEPENDENCY_FILE_EXTENSIONS,
+                                         [".xml"]))
+
+    if dependency_index is None or dependency_index.extensions != extensions:
+        dependency_index = dependencies.DependencyIndex(extensions)
+
+    return dependency_index
+
+
+def get_executor():
+    global executor
+
+    if executor is None:
+        concurrency = exalt.get_setting(settings.VALIDATION_CONCURRENCY, 2)
+        executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+
+    return executor
+
+
+def revalidate_dependents(window, path):
+    """Validate every file in the open folders of the window that depends on
+    the file at path and list the results in an output panel.
+
+    Files that are open in the window are validated in their views. The rest
+    are validated straight from disk. They have no window, so the validation
+    queue runs them at background priority."""
+    with dependency_index_lock:
+        index = get_dependency_index()
+        index.track(window.folders(), path)
+
+    dependents = sorted(index.get_dependents(path))
+
+    if not dependents:
+        return
+
+    # The saved file might be a schema, so don't use the compiled version
+    # of it we might have in the cache. A schema that includes the saved
+    # file is one of its dependents.
+    validator.forget_schemas([path] + dependents)
+
+    panel = window.create_output_panel(DEPENDENTS_PANEL)
+    panel.settings().set("result_file_regex",
+                         r"^(.+?\.[^.:\\/]+):(?:(\d+):)? ")
+
+    def append(text):
+        sublime.set_timeout(
+            lambda: panel.run_command("append", {"characters": text}), 0
+        )
+
+    append(messages.DEPENDENTS_HEADER % (len(dependents), path))
+    window.run_command("show_panel", {"panel": "output.%s" %
+                                      DEPENDENTS_PANEL})
+
+    for dependent in dependents:
+        view = window.find_open_file(dependent)
+
+        if view is not None:
+            queue.submit(view, validate_view)
+            append(messages.DEPENDENT_OPEN % dependent)
+        else:
+            queue.submit(get_headless_view(dependent),
+                         lambda view: append(validate_file(view)))
+
+
+def get_headless_view(path):
+    """Get a stand-in view for validating the file at path from disk."""
+    syntax = "XSLT" if path.lower().endswith((".xsl", ".xslt")) else "XML"
+    return dependencies.HeadlessView(path, "%s.tmLanguage" % syntax)
+
+
+def validate_file(view):
+    """Validate the file of a headless view and get the results as text."""
+    path = view.file_name()
+
+    try:
+        validate_view(view)
+        index = exalt.error_indexes.pop(view.id(), None)
+
+        if not index:
+            # The status of a valid file might've been reset already.
+            status = view.get_status(constants.PLUGIN_NAME) or \
+                messages.VALID_MARKUP
+            return messages.DEPENDENT_STATUS % (path, status)
+
+        return "".join(messages.DEPENDENT_ERROR % (path,
+                                                   view.rowcol(point)[0] + 1,
+                                                   message)
+                       for point, message in zip(index.points,
+                                                 index.messages))
+    except Exception as e:
+        return messages.DEPENDENT_STATUS % (path, e)
+    finally:
+        parsetools.forget_documents(view)
+        exalt.content_models.pop(view.id(), None)
+
+
+def update_linter(view):
+    """Bring the linter of the view up to date with the document in the view,
+    rescanning only the part of the document that changed since the last
+    update."""
+    with linter_lock:
+        checker = exalt.linters.get(view.id())
+
+        if checker is None:
+            interval = exalt.get_setting(settings.LINT_CHECKPOINT_INTERVAL,
+                                         16384)
+            checker = exalt.linters[view.id()] = linter.Linter(interval)
+
+        checker.update(vu.get_content(view))
+        return checker
+
+
+def update_outline(view):
+    """Bring the outline of the elements in the document in the view up to
+    date and get it.
+
+    After an edit, only the part of the outline that covers the segments of
+    the document the linter had to rescan is collected again. Runs on a
+    background thread."""
+    change_count = view.change_count()
+    checker = update_linter(view)
+
+    with linter_lock:
+        outline = checker.outline()
+
+    exalt.outlines[view.id()] = (change_count, outline)
+    return outline
+
+
+def with_outline(view, callback):
+    """Call callback with the outline of the document in the view on the UI
+    thread.
 
-import Exalt.impl.parsetools as parsetools
-import Exalt.impl.validator as validator
-import Exalt.impl.formatter as formatter
+    If the outline isn't up to date, bring it up to date on a background
+    thread first. Once a command has used the outline of a view, Exalt
+    keeps it up to date after edits. See ExaltValidate.on_idle_async."""
+    entry = exalt.outlines.get(view.id())
 
-invoke_async = sublime.set_timeout_async
+    if entry is not None and entry[0] == view.change_count():
+        callback(entry[1])
+        return
+
+    vu.set_status(view, messages.OUTLINE_BUILDING)
+
+    def update():
+        outline = update_outline(view)
+
+        def done():
+            view.erase_status(constants.PLUGIN_NAME)
+            callback(outline)
+
+        sublime.set_timeout(done, 0)
+
+    get_executor().submit(update)
+
+
+def lint(view):
+    """Check the well-formedness of the document in the view, rescanning only
+    the part of the document that changed since the last check."""
+    checker = update_linter(view)
+
+    with linter_lock:
+        errors = checker.errors()
+
+    if errors:
+        point, message = errors[0]
+        row, _ = view.rowcol(point)
+        vu.show_error_records(view,
+                              messages.LINT_ERROR % (message, row + 1),
+                              errors, syntax=True)
+    elif not vu.has_validation_errors(view):
+        vu.clear_errors(view)
+        view.erase_status(constants.PLUGIN_NAME)
+
+
+def watch_viewport(view):
+    """Redraw the error highlights of the view when it scrolls, for as long
+    as it's the active view of its window.
+
+    Sublime Text has no scroll event, so we poll the visible region of the
+    view. highlight_errors returns right away if the errors around the
+    viewport are already highlighted."""
+    if view.id() in watched_viewports:
+        return
+
+    watched_viewports.add(view.id())
+
+    def poll():
+        window = view.window()
+        active = window.active_view() if window is not None else None
+
+        if not view.is_valid() or active is None or active.id() != view.id():
+            watched_viewports.discard(view.id())
+            return
+
+        vu.highlight_errors(view)
+        sublime.set_timeout_async(poll, constants.VIEWPORT_POLL_INTERVAL)
+
+    poll()
+
+
+def get_completions(view, point):
+    """Get the completions the schema of the document in the view allows at
+    point, or None if we don't know the schema of the document."""
+    model = exalt.content_models.get(view.id())
+
+    if model is None:
+        return None
+
+    begin = max(0, point - completions.CONTEXT_SIZE)
+    context = completions.get_context(
+        view.substr(sublime.Region(begin, point)), begin
+    )
+
+    if context is None:
+        return None
+
+    parent = None
+
+    if context.kind in (completions.ELEMENT, completions.CONTENT):
+        parent = get_parent(view, context.start)
+
+    return completions.get_completions(model, context, parent)
+
+
+def get_fragment_parser(view, profile):
+    """Get the kind of parser ("xml" or "html") and the parser options of the
+    given profile to parse the documents in the view with.
+
+    Buffers of many documents are often logs in plain text, so anything that
+    isn't HTML is parsed as XML. Runs on the UI thread, so that the workers
+    don't have to ask the view."""
+    kind = "html" if vu.is_html(view) else "xml"
+    return kind, parsetools.get_options(view, profile)
+
+
+def get_parent(view, point):
+    """Get the name of the element that's open at point from the text right
+    before point.
+
+    Most of the time the start tag of the parent is close by, so we start
+    with a small stretch of text and only look further back if we need to,
+    up to completions.PARENT_CONTEXT_SIZE characters."""
+    size = completions.CONTEXT_SIZE
+
+    while True:
+        begin = max(0, point - size)
+        parent = completions.get_parent(
+            view.substr(sublime.Region(begin, point))
+        )
+
+        if parent is not None or begin == 0:
+            return parent
+        elif size >= completions.PARENT_CONTEXT_SIZE:
+            return completions.UNKNOWN
+
+        size *= 4
+
+
+def process_fragments(text, function):
+    """Split text into the XML documents in it and call function with the
+    text of each document on the thread pool.
+
+    Get the (begin, end) pairs of the documents and a (text, error) result
+    for each document, in document order."""
+    spans = fragments.split(text)
+    size = fragments.BATCH_SIZE
+
+    def process(batch):
+        return [function(text[begin:end]) for begin, end in batch]
+
+    batches = get_executor().map(process, [spans[i:i + size]
+                                           for i in range(0, len(spans), size)])
+
+    return spans, [result for batch in batches for result in batch]
+
+
+def format_fragments(text, kind, options):
+    """Format every document in text.
+
+    Get the formatted text, the number of documents and an (offset, message)
+    record of every error."""
+    spans, results = process_fragments(
+        text, partial(formatter.format_fragment, kind, options)
+    )
+
+    formatted, records = assemble_fragments(text, spans, results)
+    return formatted, len(spans), records
+
+
+def check_fragments(text, kind, options):
+    """Check the well-formedness of every document in text.
+
+    Get the number of documents and an (offset, message) record of every
+    error."""
+    spans, results = process_fragments(
+        text, partial(formatter.check_fragment, kind, options)
+    )
+
+    _, records = assemble_fragments(text, spans, results)
+    return len(spans), records
+
+
+def assemble_fragments(text, spans, results):
+    """Put the processed documents back in place of the original ones.
+
+    Get the new text and an (offset, message) record of every error, with
+    the offsets in the new text."""
+    pieces = []
+    records = []
+    position = 0
+    last = 0
+
+    for number, ((begin, end), (output, error)) in enumerate(zip(spans,
+                                                                 results)):
+        pieces.append(text[last:begin])
+        position += begin - last
+
+        if error is not None:
+            offset, message = error
+            records.append((position + offset,
+                            messages.FRAGMENT_ERROR % (number + 1, message)))
+
+        pieces.append(output)
+        position += len(output)
+        last = end
+
+    pieces.append(text[last:])
+    return "".join(pieces), records
+
+
+def report_fragments(view, count, records, done):
+    if records:
+        vu.show_error_records(view,
+                              messages.FRAGMENT_ERRORS % (len(records),
+                                                          count,
+                                                          records[0][1]),
+                              records, syntax=True)
+    else:
+        vu.clear_errors(view)
+        vu.set_status(view, done % count)
+        vu.reset_status(view)
+
+
+def get_startup_report():
+    lines = [messages.STARTUP_REPORT, ""]
+
+    for label, seconds in exalt.startup_report.items():
+        lines.append("%-40s %10.1f ms" % (label, seconds * 1000))
+
+    if messages.FIRST_VALIDATION not in exalt.startup_report:
+        lines.append(messages.NO_VALIDATION_YET)
+
+    return "\n".join(lines) + "\n"
+
+
+class ExaltShowStartupReportCommand(TextCommand):
+    def run(self, edit):
+        report = self.view.window().new_file()
+        report.set_scratch(True)
+        report.set_name(messages.STARTUP_REPORT)
+        report.run_command("append", {"characters": get_startup_report()})
 
 
 class ExaltClearCacheCommand(TextCommand):
     def run(self, edit):
         exalt.parser_cache.clear()
+        exalt.document_cache.clear()
+        exalt.include_cache.clear()
+        exalt.xslt_cache.clear()
 
 
 class ExaltFormatCommand(TextCommand):
@@ -51,15 +569,54 @@ class ExaltFormatCommand(TextCommand):
 
 
 class ExaltCanonicalizeDocumentCommand(TextCommand):
-    def run(self, edit):
+    def run(self, edit, version="1.0", exclusive=False, with_comments=False,
+            inclusive_ns_prefixes=None, strip_text=False,
+            rewrite_prefixes=False):
+        load()
         view = self.view
         region = sublime.Region(0, view.size())
-        c14n = formatter.canonicalize_document(view, region)
-        view.replace(edit, region, c14n)
+
+        if version == "2.0":
+            self.stream(edit, region,
+                        with_comments=with_comments,
+                        strip_text=strip_text,
+                        rewrite_prefixes=rewrite_prefixes)
+        else:
+            c14n = formatter.canonicalize_document(
+                view,
+                region,
+                exclusive=exclusive,
+                with_comments=with_comments,
+                inclusive_ns_prefixes=inclusive_ns_prefixes
+            )
+
+            view.replace(edit, region, c14n)
+
+    def stream(self, edit, region, **kwargs):
+        """Canonicalize the region with C14N 2.0 without holding the entire
+        document in memory.
+
+        The output goes after the end of the document while the document
+        is being read, and the original document is removed only once
+        we're done."""
+        view = self.view
+        end = region.end()
+
+        def write(text):
+            view.insert(edit, view.size(), text)
+
+        try:
+            formatter.stream_canonicalized_document(view, region, write,
+                                                    **kwargs)
+            view.erase(edit, region)
+        except etree.XMLSyntaxError as e:
+            view.erase(edit, sublime.Region(end, view.size()))
+            vu.show_errors(view, e, e.error_log.filter_from_errors())
 
 
 class ExaltFormatDocumentCommand(ExaltFormatCommand):
     def run(self, edit):
+        load()
         view = self.view
         region = sublime.Region(0, view.size())
 
@@ -97,6 +654,7 @@ class ExaltFormatSelectionsCommand(ExaltFormatCommand):
         return self.NEWLINE.join(lines)
 
     def run(self, edit):
+        load()
         view = self.view
 
         for region in view.sel():
@@ -104,52 +662,463 @@ class ExaltFormatSelectionsCommand(ExaltFormatCommand):
             view.replace(edit, region, xml)
 
 
-class ExaltValidateCommand(TextCommand):
+class ExaltFormatFragmentsCommand(TextCommand):
+    """Format every XML document in a buffer that holds many of them, such
+    as a log or a message dump.
+
+    Documents that aren't well-formed are left as they are. The documents
+    are formatted in the background, and exalt_replace_fragments puts the
+    result into the view once they're done."""
+
     def run(self, edit):
+        load()
         view = self.view
+        kind, options = get_fragment_parser(view, "format")
+        text = vu.get_content(view)
+        change_count = view.change_count()
+
+        vu.set_status(view, messages.FRAGMENTS_FORMATTING)
 
-        if not vu.is_xml(view) or len(vu.get_content(view).strip()) == 0:
+        def format():
+            formatted_fragments[view.id()] = (
+                change_count, format_fragments(text, kind, options)
+            )
+
+            sublime.set_timeout(
+                lambda: view.run_command("exalt_replace_fragments"), 0
+            )
+
+        threading.Thread(target=format, daemon=True).start()
+
+
+class ExaltReplaceFragmentsCommand(TextCommand):
+    """Replace the contents of the view with the documents
+    exalt_format_fragments formatted, unless the view has changed in the
+    meantime."""
+
+    def run(self, edit):
+        view = self.view
+        pending = formatted_fragments.pop(view.id(), None)
+
+        if pending is None:
             return
 
-        try:
-            parser = parsetools.get_parser(
-                view,
-                encoding=encodings.UTF8,
-                load_dtd=True
+        change_count, (formatted, count, records) = pending
+
+        if view.change_count() != change_count:
+            vu.set_status(view, messages.FRAGMENTS_CHANGED)
+            return
+
+        view.replace(edit, sublime.Region(0, view.size()), formatted)
+        report_fragments(view, count, records, messages.FRAGMENTS_FORMATTED)
+
+
+class ExaltCheckFragmentsCommand(TextCommand):
+    """Check the well-formedness of every XML document in a buffer that
+    holds many of them."""
+
+    def run(self, edit):
+        load()
+        view = self.view
+        kind, options = get_fragment_parser(view, "wellformed")
+
+        vu.set_status(view, messages.FRAGMENTS_CHECKING)
+
+        threading.Thread(target=self.check,
+                         args=(vu.get_content(view), kind, options),
+                         daemon=True).start()
+
+    def check(self, text, kind, options):
+        count, records = check_fragments(text, kind, options)
+        report_fragments(self.view, count, records,
+                         messages.FRAGMENTS_WELL_FORMED)
+
+
+class ExaltValidateCommand(TextCommand):
+    def run(self, edit, lean=False):
+        view = self.view
+
+        if not vu.is_xml(view) or vu.is_blank(view):
+            return
+
+        load()
+        queue.submit(view, partial(validate_view, lean=lean))
+
+
+class ExaltEvaluateXpathCommand(TextCommand):
+    def run(self, edit, expression=None):
+        global xpath_query, xpath_expression
+
+        view = self.view
+
+        if expression is None:
+            view.window().show_input_panel(
+                messages.XPATH_PROMPT,
+                xpath_expression,
+                lambda e: view.run_command("exalt_evaluate_xpath",
+                                           {"expression": e}),
+                None,
+                None
             )
+            return
+
+        load()
+        xpath_query += 1
+        xpath_expression = expression
+        vu.set_status(view, messages.XPATH_EVALUATING)
+
+        threading.Thread(target=self.evaluate,
+                         args=(expression, xpath_query),
+                         daemon=True).start()
+
+    def evaluate(self, expression, query):
+        view = self.view
+
+        def is_cancelled():
+            return query != xpath_query
+
+        try:
+            items = xpath.evaluate(view, expression, is_cancelled)
+        except xpath.Cancelled:
+            return
+        except (etree.XPathError, etree.XMLSyntaxError) as e:
+            vu.set_status(view, messages.XPATH_ERROR % e)
+            return
+        finally:
+            # Whatever went wrong, don't leave the status bar saying we're
+            # still evaluating. A newer query owns the status, though.
+            if not is_cancelled() and view.get_status(
+                    constants.PLUGIN_NAME) == messages.XPATH_EVALUATING:
+                view.erase_status(constants.PLUGIN_NAME)
+
+        if is_cancelled():
+            return
+
+        if not items:
+            vu.set_status(view, messages.XPATH_NO_RESULTS)
+            vu.reset_status(view)
+            return
+
+        sublime.set_timeout(lambda: self.show(items), 0)
+
+    def show(self, items):
+        view = self.view
+
+        def on_select(index):
+            line = items[index][1] if index >= 0 else None
+
+            if line is not None:
+                vu.go_to_point(view, view.text_point(line - 1, 0))
+
+        labels = [[label, messages.XPATH_LINE % line if line else ""]
+                  for label, line in items]
+
+        view.window().show_quick_panel(labels, on_select)
+
+
+class ExaltCancelXpathCommand(TextCommand):
+    def run(self, edit):
+        global xpath_query
+
+        xpath_query += 1
+        vu.set_status(self.view, messages.XPATH_CANCELLED)
+        vu.reset_status(self.view)
 
-            doc = parsetools.parse_string(view, parser, vu.get_content(view))
 
-            if vu.is_xslt(view):
-                version = doc.getroot().get(constants.VERSION)
-                relax_ng = validator.get_xslt_relaxng_path(version)
+class ExaltTransformCommand(TextCommand):
+    """Apply an XSLT stylesheet to a document and open the result in a new
+    view.
 
-                v = validator.get_validator_for_namespace(
-                    isoschematron.RELAXNG_NS
-                )(view, doc, relax_ng)
+    If the view is a stylesheet, apply it to a document the user picks.
+    Otherwise, apply a stylesheet the user picks to the document in the
+    view."""
 
-                invoke_async(lambda: v, 0)
+    def run(self, edit, stylesheet=None, source=None, parameters=None,
+            profile=False):
+        global last_stylesheet, last_source
+
+        view = self.view
+        args = {"parameters": parameters, "profile": profile}
+
+        if vu.is_xslt(view):
+            if source is None:
+                self.prompt(messages.TRANSFORM_SOURCE_PROMPT, last_source,
+                            dict(args, source=""), "source")
+                return
+
+            last_source = source
+        else:
+            if stylesheet is None:
+                self.prompt(messages.TRANSFORM_STYLESHEET_PROMPT,
+                            last_stylesheet, dict(args, stylesheet=""),
+                            "stylesheet")
+                return
+
+            last_stylesheet = stylesheet
+
+        load()
+        vu.set_status(view, messages.TRANSFORMING)
+
+        if parameters is None:
+            parameters = exalt.get_setting(settings.XSLT_PARAMETERS, {})
+
+        get_executor().submit(self.transform, stylesheet, source, parameters,
+                              profile)
+
+    def prompt(self, caption, initial, args, key):
+        view = self.view
+
+        def on_done(path):
+            args[key] = os.path.expanduser(path)
+            view.run_command("exalt_transform", args)
+
+        view.window().show_input_panel(caption, initial, on_done, None, None)
+
+    def transform(self, stylesheet, source, parameters, profile):
+        view = self.view
+        started = time.perf_counter()
+
+        try:
+            if stylesheet is None:
+                # Use what's in the view, even if it hasn't been saved yet.
+                compiled = transform.compile_stylesheet(
+                    parsetools.parse_view(view, "validate", from_file=True),
+                    view.file_name()
+                )
             else:
-                invoke_async(lambda: validator.try_validate(view, doc), 0)
-        except etree.XMLSyntaxError as e:
-            message = str(e)
+                compiled = transform.get_stylesheet(stylesheet)
+
+            if source is None:
+                document = parsetools.parse_view(view, "validate",
+                                                 from_file=True)
+            else:
+                document = etree.parse(source)
+
+            result = transform.transform(compiled, document, parameters,
+                                         profile)
+        except (etree.XSLTError, etree.XMLSyntaxError, OSError) as e:
+            vu.set_status(view, messages.TRANSFORM_ERROR % e)
+            return
+        except Exception as e:
+            # The executor would swallow the error and leave the status bar
+            # saying we're still transforming.
+            traceback.print_exc()
+            vu.set_status(view, messages.TRANSFORM_ERROR % e)
+            return
+
+        elapsed = time.perf_counter() - started
+        sublime.set_timeout(lambda: self.show(result, elapsed), 0)
+
+    def show(self, result, elapsed):
+        window = self.view.window()
+
+        output = self.open(window, messages.TRANSFORM_RESULT, result.text)
+        output.set_syntax_file(RESULT_SYNTAXES[result.method])
+
+        if result.profile is not None:
+            self.open(window, messages.TRANSFORM_PROFILE, result.profile)
+
+        status = messages.TRANSFORM_DONE % elapsed
+
+        if result.messages:
+            status = "%s: %s" % (status, "; ".join(result.messages))
+
+        vu.set_status(output, status)
+        self.view.erase_status(constants.PLUGIN_NAME)
+
+    def open(self, window, name, text):
+        view = window.new_file()
+        view.set_scratch(True)
+        view.set_name(name)
+        view.run_command("append", {"characters": text})
+        return view
+
+
+class ExaltGoToElementCommand(TextCommand):
+    def run(self, edit):
+        view = self.view
+
+        if not vu.is_xml(view):
+            return
+
+        def show(outline):
+            def on_select(index):
+                if index >= 0:
+                    vu.go_to_point(view, outline.start(index))
+
+            view.window().show_quick_panel(outline.labels(), on_select)
+
+        with_outline(view, show)
+
+
+class ExaltGoToIdCommand(TextCommand):
+    def run(self, edit):
+        view = self.view
+
+        if not vu.is_xml(view):
+            return
+
+        def show(outline):
+            ids = sorted(outline.ids().items(), key=lambda item: item[1])
+
+            def on_select(index):
+                if index >= 0:
+                    vu.go_to_point(view, outline.start(ids[index][1]))
 
-            if constants.LXML_NO_DTD_FOUND not in message:
-                error = parser.error_log.filter_from_errors()[0]
-                vu.show_error(view, message, error)
+            items = [[id, outline.get_path(i)] for id, i in ids]
+            view.window().show_quick_panel(items, on_select)
+
+        with_outline(view, show)
+
+
+class ExaltExpandSelectionToElementCommand(TextCommand):
+    def run(self, edit):
+        view = self.view
+
+        if not vu.is_xml(view):
+            return
+
+        def expand(outline):
+            regions = []
+
+            for region in view.sel():
+                i = outline.enclosing(region.begin(), region.end())
+
+                if i is None:
+                    regions.append(region)
+                else:
+                    regions.append(sublime.Region(outline.start(i),
+                                                  outline.end(i)))
+
+            view.sel().clear()
+            view.sel().add_all(regions)
+
+        with_outline(view, expand)
 
 
 class ExaltGoToErrorCommand(TextCommand):
     def run(self, edit):
-        self.view.show_at_center(exalt.error_point)
+        vu.go_to_error(self.view, 0)
+
+
+class ExaltNextErrorCommand(TextCommand):
+    def run(self, edit):
+        view = self.view
+        index = vu.get_error_index(view)
+
+        if index:
+            vu.go_to_error(view, index.next(view.sel()[0].begin()))
+
+
+class ExaltPreviousErrorCommand(TextCommand):
+    def run(self, edit):
+        view = self.view
+        index = vu.get_error_index(view)
+
+        if index:
+            vu.go_to_error(view, index.previous(view.sel()[0].begin()))
+
+
+class ExaltListErrorsCommand(TextCommand):
+    def run(self, edit):
+        view = self.view
+        index = vu.get_error_index(view)
+
+        if not index:
+            return
+
+        def on_select(position):
+            if position >= 0:
+                vu.go_to_error(view, position)
+            else:
+                view.show_at_center(view.sel()[0].begin())
+
+        def on_highlight(position):
+            view.show_at_center(index.points[position])
+
+        items = []
+
+        for point, message in zip(index.points, index.messages):
+            row, column = view.rowcol(point)
+            items.append([message, messages.ERROR_LOCATION % (
+                row + 1, column + 1, vu.get_error_excerpt(view, point)
+            )])
+
+        view.window().show_quick_panel(items, on_select, 0,
+                                       index.current or 0, on_highlight)
 
 
 class ExaltValidate(EventListener):
     def on_pre_save_async(self, view):
         view.run_command("exalt_validate")
 
+    def on_post_save_async(self, view):
+        window = view.window()
+
+        if exalt.get_setting(settings.VALIDATE_DEPENDENTS, False) and \
+           window is not None and window.folders() and view.file_name():
+            load()
+            get_executor().submit(revalidate_dependents,
+                                  window,
+                                  view.file_name())
+
     def on_load_async(self, view):
-        view.run_command("exalt_validate")
+        view.run_command("exalt_validate", {"lean": True})
 
     def on_activated_async(self, view):
-        view.run_command("exalt_validate")
+        view.run_command("exalt_validate", {"lean": True})
+        watch_viewport(view)
+
+    def on_modified_async(self, view):
+        delay = exalt.get_setting(settings.IDLE_VALIDATION_DELAY, 1000)
+
+        # Don't validate background tabs while the user is typing.
+        queue.defer_background(delay)
+
+        if not vu.is_xml(view):
+            return
+
+        if exalt.get_setting(settings.LINT_WHILE_TYPING, False):
+            lint(view)
+        elif view.id() not in exalt.outlines:
+            return
+
+        change_count = view.change_count()
+
+        sublime.set_timeout_async(
+            lambda: self.on_idle_async(view, change_count), delay
+        )
+
+    def on_idle_async(self, view, change_count):
+        if not view.is_valid() or view.change_count() != change_count:
+            return
+
+        # Have the outline ready for the next navigation command.
+        if view.id() in exalt.outlines:
+            update_outline(view)
+
+        # Run a full validation once the user stops typing.
+        if exalt.get_setting(settings.LINT_WHILE_TYPING, False):
+            view.run_command("exalt_validate", {"lean": True})
+
+    def on_selection_modified_async(self, view):
+        vu.highlight_errors(view)
+
+    def on_close(self, view):
+        exalt.error_indexes.pop(view.id(), None)
+        exalt.linters.pop(view.id(), None)
+        exalt.outlines.pop(view.id(), None)
+        exalt.content_models.pop(view.id(), None)
+        formatted_fragments.pop(view.id(), None)
+        watched_viewports.discard(view.id())
+
+        if parsetools is not None:
+            parsetools.forget_documents(view)
+
+
+class ExaltComplete(EventListener):
+    def on_query_completions(self, view, prefix, locations):
+        if len(locations) != 1 or not vu.is_xml(view):
+            return None
+
+        return get_completions(view, locations[0])
@@ -0,0 +1,168 @@
+"""A queue for validation jobs shared by every Sublime Text window.
+
+Jobs run on a small pool of worker threads. Whenever a worker is free, it
+picks the job whose view the user is most likely looking at: the active view
+first, then the views that are visible in the other groups, and the views in
+background tabs last. Background jobs wait while the user is typing."""
+
+import threading
+import time
+import traceback
+
+from collections import OrderedDict
+
+import sublime
+
+ACTIVE = 0
+VISIBLE = 1
+BACKGROUND = 2
+
+
+def get_priority(view):
+    """Get the priority of the jobs of the given view."""
+    window = view.window()
+
+    if window is None:
+        return BACKGROUND
+
+    active = window.active_view()
+
+    if active is not None and active.id() == view.id() and \
+       window.id() == sublime.active_window().id():
+        return ACTIVE
+
+    for group in range(window.num_groups()):
+        visible = window.active_view_in_group(group)
+
+        if visible is not None and visible.id() == view.id():
+            return VISIBLE
+
+    return BACKGROUND
+
+
+class Scheduler:
+    """Run at most one job per view at a time.
+
+    concurrency is a function that returns the maximum number of worker
+    threads, so that changing the setting takes effect right away. The
+    priority of a job is only decided when a worker picks it up, since
+    the user might switch tabs while the job is waiting.
+
+    Workers are started as they're needed and then wait for more jobs
+    instead of exiting, so that the per-thread state of the worker, such as
+    its pool of parsers, outlives a single burst of jobs."""
+
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.condition = threading.Condition()
+        self.pending = OrderedDict()
+        self.running = set()
+        self.workers = 0
+        self.deferred_until = 0
+
+    def submit(self, view, function):
+        """Queue function to be called with view as its argument.
+
+        If the view already has a job waiting, the new job replaces it."""
+        with self.condition:
+            self.pending[view.id()] = (view, function)
+            self.condition.notify_all()
+
+        self.dispatch()
+
+    def defer_background(self, delay):
+        """Don't start background jobs for delay milliseconds."""
+        self.deferred_until = time.monotonic() + delay / 1000
+
+    def dispatch(self):
+        """Start workers for the pending jobs, up to the concurrency budget."""
+        with self.condition:
+            missing = min(len(self.pending), self._get_concurrency()) - \
+                self.workers
+
+            for _ in range(missing):
+                number = self.workers
+                self.workers += 1
+                threading.Thread(target=self._work, args=(number,),
+                                 daemon=True).start()
+
+    def _get_concurrency(self):
+        return max(1, self.concurrency())
+
+    def _work(self, number):
+        while True:
+            with self.condition:
+                job = None
+
+                while job is None:
+                    # If the concurrency setting went down, the workers
+                    # over the budget stay idle.
+                    if number < self._get_concurrency():
+                        job = self._take()
+
+                    if job is None:
+                        self.condition.wait(self._get_timeout())
+
+                view, function = job
+                self.running.add(view.id())
+
+            try:
+                function(view)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self.condition:
+                    self.running.discard(view.id())
+
+                    # The view might have got another job while this one
+                    # was running.
+                    self.condition.notify_all()
+
+    def _take(self):
+        """Remove the job with the highest priority from the queue and return
+        it.
+
+        Returns None if there's nothing a worker can run right now."""
+        best = None
+        best_priority = None
+
+        for view_id, (view, function) in list(self.pending.items()):
+            if not view.is_valid():
+                del self.pending[view_id]
+                continue
+
+            if view_id in self.running:
+                continue
+
+            priority = get_priority(view)
+
+            if best is None or priority < best_priority:
+                best = view_id
+                best_priority = priority
+
+                if priority == ACTIVE:
+                    break
+
+        if best is None:
+            return None
+
+        remaining = self.deferred_until - time.monotonic()
+
+        if best_priority == BACKGROUND and remaining > 0:
+            return None
+
+        return self.pending.pop(best)
+
+    def _get_timeout(self):
+        """Get the number of seconds an idle worker should wait before
+        looking at the queue again, or None to wait until a job comes in.
+
+        Background jobs wait for the user to stop typing without anyone
+        notifying the workers, so the workers need to wake up by
+        themselves."""
+        remaining = self.deferred_until - time.monotonic()
+
+        if not self.pending or remaining <= 0:
+            return None
+
+        return remaining + 0.001
@@ -0,0 +1,283 @@
+"""Incremental ISO Schematron validation.
+
+A Schematron schema with thousands of assertions can take seconds to run
+against a large document, even if only one element has changed since the
+last run. Instead of running the whole schema every time, we split it into its
+patterns and compile each pattern on its own. When a document is validated
+again, we only run the patterns whose rule contexts match nodes that have
+changed since the last validation, and reuse the earlier findings of the
+other patterns.
+
+A pattern's findings can only be reused if its assertions only look at the
+context node and its descendants. If any of its tests can look elsewhere in
+the document, for example via an absolute path or the preceding axis, the
+pattern runs every time."""
+
+import copy
+import re
+
+from lxml import etree
+
+import Exalt.exalt as exalt
+import Exalt.namespaces as namespaces
+
+# The key of an incremental Schematron validator in the parser cache is
+# (KEY, schema file).
+KEY = "incremental-schematron"
+
+# The number of documents per schema whose findings we keep.
+MAX_DOCUMENTS = 10
+
+SCH = {"sch": namespaces.SCHEMATRON}
+SVRL = {"svrl": namespaces.SVRL}
+
+PATTERN = "{%s}pattern" % namespaces.SCHEMATRON
+PHASE = "{%s}phase" % namespaces.SCHEMATRON
+
+# Expressions that can look outside the subtree of the context node.
+NONLOCAL = re.compile(r"""
+    (?:^|[\s(,\[=<>!+|])/
+  | \.\.
+  | \b(?:ancestor|ancestor-or-self|parent|preceding|preceding-sibling
+        |following|following-sibling)::
+  | \b(?:document|doc|key|id|idref|collection)\s*\(
+""", re.X)
+
+# The attributes of Schematron elements that hold XPath expressions.
+EXPRESSIONS = ".//sch:*/@test | .//sch:*/@select | .//sch:*/@path" \
+    " | .//sch:let/@value"
+
+
+class Finding:
+    """A failed assertion."""
+
+    def __init__(self, location, message):
+        self.location = location
+        self.message = message
+
+
+class IncrementalSchematron:
+    """An ISO Schematron schema that only reruns the patterns it needs to.
+
+    The schematron argument is the lxml.isoschematron.Schematron class,
+    which takes a while to import, so the validator module passes it in once
+    it's loaded it."""
+
+    def __init__(self, schematron, file):
+        full = schematron(file=file, store_schematron=True)
+        root = full.schematron.getroot()
+        prefixes = {ns.get("prefix"): ns.get("uri")
+                    for ns in root.iterfind("sch:ns", SCH)}
+
+        self.patterns = [_Pattern(schematron, _split(root, pattern), prefixes)
+                         for pattern in _get_active_patterns(root)]
+
+        self.states = exalt.LimitedOrderedDict(max_size=MAX_DOCUMENTS)
+
+    def validate(self, key, document):
+        """Validate the document and get the Findings of the failed
+        assertions.
+
+        The key identifies the document across validations. The patterns
+        whose contexts match the same nodes with the same content as when
+        the document with the same key was last validated aren't run
+        again."""
+        previous = self.states.pop(key, None) or \
+            [(None, None)] * len(self.patterns)
+        state = []
+        findings = []
+
+        # The contexts of different patterns often match the same nodes, so
+        # fingerprint each node only once per run.
+        fingerprints = {}
+
+        for pattern, (signature, cached) in zip(self.patterns, previous):
+            current = pattern.get_signature(document, fingerprints)
+
+            if current is None or current != signature:
+                cached = pattern.run(document)
+
+            state.append((current, cached))
+            findings.extend(cached)
+
+        self.states[key] = state
+        return findings
+
+
+def get_line(document, finding):
+    """Get the line number of the node a Finding is about, or 1 if we can't
+    find the node."""
+    try:
+        nodes = document.xpath(finding.location)
+    except (etree.XPathError, TypeError):
+        return 1
+
+    if isinstance(nodes, list) and nodes and \
+       getattr(nodes[0], "sourceline", None):
+        return nodes[0].sourceline
+
+    return 1
+
+
+###########
+# PRIVATE #
+###########
+
+
+class _Pattern:
+    def __init__(self, schematron, root, prefixes):
+        self.schematron = schematron(etree=root,
+                                     include=False,
+                                     expand=False,
+                                     store_report=True,
+                                     validate_schema=False)
+
+        # The split schema also has the variables declared outside
+        # patterns, so this checks those, too.
+        self.contexts = _compile_contexts(root, prefixes) \
+            if _is_local(root) else None
+
+    def get_signature(self, document, fingerprints):
+        """Get the paths and the content of the nodes the rules of the
+        pattern apply to, or None if the pattern must always run.
+
+        The fingerprints dict holds the fingerprints of the elements
+        computed so far during this validation run."""
+        if self.contexts is None:
+            return None
+
+        try:
+            nodes = self.contexts(document)
+        except etree.XPathError:
+            return None
+
+        if not isinstance(nodes, list):
+            return None
+
+        return tuple(_get_fingerprint(document, node, fingerprints)
+                     for node in nodes)
+
+    def run(self, document):
+        self.schematron.validate(document)
+        report = self.schematron.validation_report
+
+        return [Finding(failure.get("location"), _get_message(failure))
+                for failure in report.iterfind(".//svrl:failed-assert",
+                                               SVRL)]
+
+
+def _get_active_patterns(root):
+    patterns = root.findall("sch:pattern", SCH)
+    phase = root.get("defaultPhase")
+
+    if phase is None or phase == "#ALL":
+        return patterns
+
+    active = set(root.xpath("sch:phase[@id = $phase]/sch:active/@pattern",
+                            namespaces=SCH, phase=phase))
+
+    return [pattern for pattern in patterns if pattern.get("id") in active]
+
+
+def _split(root, pattern):
+    """Get a copy of the schema with the given pattern as its only
+    pattern."""
+    split = etree.Element(root.tag, nsmap=root.nsmap)
+    split.attrib.update(root.attrib)
+    split.attrib.pop("defaultPhase", None)
+
+    for child in root:
+        if child.tag == PHASE or (child.tag == PATTERN and
+                                  child is not pattern):
+            continue
+
+        split.append(copy.deepcopy(child))
+
+    return split
+
+
+def _is_local(root):
+    """Check whether the XPath expressions in the schema only look at the
+    context node and its descendants."""
+    return not any(NONLOCAL.search(expression)
+                   for expression in root.xpath(EXPRESSIONS, namespaces=SCH))
+
+
+def _compile_contexts(root, prefixes):
+    """Compile an XPath expression that selects the nodes the rule contexts
+    of the pattern match, or get None if we can't."""
+    branches = []
+
+    for rule in root.iterfind("sch:pattern/sch:rule", SCH):
+        if rule.get("abstract") == "true" or rule.get("context") is None:
+            continue
+
+        for branch in _split_union(rule.get("context")):
+            branch = branch.strip()
+
+            # The document node isn't in XPath results.
+            if branch == "/" or not branch:
+                return None
+
+            branches.append(branch if branch.startswith("/")
+                            else "//" + branch)
+
+    if not branches:
+        return None
+
+    try:
+        return etree.XPath(" | ".join(branches), namespaces=prefixes)
+    except etree.XPathSyntaxError:
+        return None
+
+
+def _split_union(context):
+    """Split an XSLT pattern into its alternatives."""
+    branches = []
+    depth = 0
+    quote = None
+    start = 0
+
+    for i, character in enumerate(context):
+        if quote is not None:
+            if character == quote:
+                quote = None
+        elif character in "\"'":
+            quote = character
+        elif character in "[(":
+            depth += 1
+        elif character in "])":
+            depth -= 1
+        elif character == "|" and depth == 0:
+            branches.append(context[start:i])
+            start = i + 1
+
+    branches.append(context[start:])
+    return branches
+
+
+def _get_fingerprint(document, node, fingerprints):
+    if isinstance(node, etree._Element):
+        fingerprint = fingerprints.get(node)
+
+        if fingerprint is None:
+            fingerprint = (document.getpath(node),
+                           hash(etree.tostring(node, with_tail=False)))
+            fingerprints[node] = fingerprint
+
+        return fingerprint
+
+    parent = node.getparent() if hasattr(node, "getparent") else None
+    path = document.getpath(parent) if parent is not None else None
+    name = node.attrname if getattr(node, "is_attribute", False) else None
+
+    return (path, name, str(node))
+
+
+def _get_message(failure):
+    text = failure.find("svrl:text", SVRL)
+
+    if text is None:
+        return failure.get("test", "")
+
+    return " ".join("".join(text.itertext()).split())
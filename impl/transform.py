@@ -0,0 +1,198 @@
+"""Run XSLT 1.0 transformations.
+
+Compiling a stylesheet can take longer than running it, so compiled
+stylesheets are cached. A cached stylesheet is only compiled again if the
+stylesheet or one of the stylesheets it imports or includes, directly or
+indirectly, has changed on disk since it was compiled."""
+
+import copy
+import os
+import threading
+
+from lxml import etree
+
+import Exalt.exalt as exalt
+import Exalt.namespaces as namespaces
+
+import Exalt.impl.dependencies as dependencies
+
+IMPORTS = "/*/xsl:import/@href | /*/xsl:include/@href"
+OUTPUT_METHOD = "string(/*/xsl:output[@method][last()]/@method)"
+OUTPUT_METHODS = ("xml", "html", "text")
+
+_cache_lock = threading.Lock()
+
+
+class Result:
+    """The output of a transformation."""
+
+    def __init__(self, text, method, messages, profile=None):
+        self.text = text
+        self.method = method
+        self.messages = messages
+        self.profile = profile
+
+
+class Stylesheet:
+    """A compiled stylesheet and the output method its xsl:output element
+    declares, or None if it doesn't declare one.
+
+    The compiled stylesheet keeps the xsl:message output of its last run in
+    its error log, so it must only run one transformation at a time."""
+
+    def __init__(self, xslt, method):
+        self.xslt = xslt
+        self.method = method
+        self.lock = threading.Lock()
+
+
+def get_stylesheet(path):
+    """Get the compiled stylesheet at path, compiling it only if it or any of
+    the stylesheets it depends on have changed since it was last
+    compiled."""
+    path = os.path.abspath(path)
+
+    with _cache_lock:
+        entry = exalt.xslt_cache.get(path)
+
+    if entry is not None:
+        stamps, stylesheet = entry
+
+        if all(_get_stamp(dependency) == stamp
+               for dependency, stamp in stamps.items()):
+            with _cache_lock:
+                exalt.xslt_cache.move_to_end(path)
+
+            return stylesheet
+
+    # Take the stamps before reading the files so that if a file changes
+    # while we're compiling, we'll compile it again next time.
+    found = get_dependencies(path)
+    stamps = {dependency: _get_stamp(dependency) for dependency in found}
+
+    stylesheet = _compile(etree.parse(path), found[1:])
+
+    with _cache_lock:
+        exalt.xslt_cache[path] = (stamps, stylesheet)
+
+    return stylesheet
+
+
+def compile_stylesheet(document, path=None):
+    """Compile a stylesheet that's already been parsed, without caching
+    it.
+
+    If the document wasn't parsed from a file, path is the file relative
+    xsl:import and xsl:include elements are resolved against."""
+    if path is not None and document.docinfo.URL is None:
+        # The tree may be shared, so set the URL on a copy of it.
+        document = copy.deepcopy(document)
+        document.docinfo.URL = exalt.file_to_uri(path)
+
+    imported = get_dependencies(path)[1:] if path is not None else []
+    return _compile(document, imported)
+
+
+def get_dependencies(path):
+    """Get the paths of the stylesheet at path and all the local stylesheets
+    it imports or includes, directly or indirectly."""
+    found = []
+    pending = [path]
+
+    while pending:
+        current = pending.pop()
+
+        if current in found:
+            continue
+
+        found.append(current)
+
+        try:
+            hrefs = etree.parse(current).xpath(
+                IMPORTS, namespaces={"xsl": namespaces.XSLT}
+            )
+        except (OSError, etree.XMLSyntaxError):
+            continue
+
+        for href in hrefs:
+            dependency = dependencies.resolve(os.path.dirname(current), href)
+
+            if dependency is not None:
+                pending.append(dependency)
+
+    return found
+
+
+def transform(stylesheet, document, parameters=None, profile=False):
+    """Apply the compiled stylesheet to the document.
+
+    The parameters are a dict of XSLT parameter names and string values. If
+    profile is True, the Result includes libxslt's profiling information."""
+    parameters = {name: etree.XSLT.strparam(str(value))
+                  for name, value in (parameters or {}).items()}
+
+    with stylesheet.lock:
+        output = stylesheet.xslt(document, profile_run=profile, **parameters)
+        messages = [entry.message for entry in stylesheet.xslt.error_log]
+    report = None
+
+    if profile:
+        report = etree.tostring(output.xslt_profile, encoding=str,
+                                pretty_print=True)
+
+    # str() serializes the output the way the xsl:output element of the
+    # stylesheet says.
+    return Result(str(output), stylesheet.method or _guess_method(output),
+                  messages, report)
+
+
+###########
+# PRIVATE #
+###########
+
+
+def _get_stamp(path):
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+def _compile(document, imported):
+    method = _get_output_method(document)
+
+    # An xsl:output element in the stylesheet itself takes precedence over
+    # the ones in the stylesheets it imports.
+    if method is None:
+        for dependency in imported:
+            try:
+                method = _get_output_method(etree.parse(dependency))
+            except (OSError, etree.XMLSyntaxError):
+                continue
+
+            if method is not None:
+                break
+
+    return Stylesheet(etree.XSLT(document), method)
+
+
+def _get_output_method(document):
+    method = document.xpath(OUTPUT_METHOD,
+                            namespaces={"xsl": namespaces.XSLT}).strip()
+
+    # Prefixed methods are extensions we don't know how to show.
+    return method if method in OUTPUT_METHODS else None
+
+
+def _guess_method(output):
+    # Without an xsl:output method, XSLT outputs HTML if the root element of
+    # the result is html.
+    root = output.getroot()
+
+    if root is None:
+        return "text"
+    elif isinstance(root.tag, str) and root.tag.lower() == "html":
+        return "html"
+    else:
+        return "xml"
@@ -1,18 +1,31 @@
 import os
 import io
+import importlib
+import threading
 
 import Exalt.view as vu
 import Exalt.messages as messages
-import Exalt.encodings as encodings
+import Exalt.settings as settings
 import Exalt.constants as constants
+import Exalt.encodings as encodings
 import Exalt.namespaces as namespaces
 import Exalt.utils as utils
 import Exalt.exalt as exalt
 
+import Exalt.impl.contentmodel as contentmodel
+import Exalt.impl.locations as locations
+import Exalt.impl.schematron as schematron
+
+import urllib.request as urllib
+
 from functools import partial
+from urllib.parse import urlparse
 
 from lxml import etree
-from lxml import isoschematron
+
+# Documents are validated on several threads at once. A compiled schema keeps
+# the error log of the document it last validated, so it must only validate
+# one document at a time. Each cached schema has a lock of its own for that.
 
 
 ##########
@@ -36,22 +49,28 @@ def get_xslt_relaxng_path(version):
     return exalt.file_to_uri(path)
 
 
+def validate_xslt(view, document):
+    """Validate an XSLT stylesheet against the RelaxNG schema for its XSLT
+    version."""
+    version = document.getroot().get(constants.VERSION)
+    relax_ng = get_xslt_relaxng_path(version)
+    validator = get_validator_for_namespace(namespaces.RELAXNG)
+    return validator(view, document, relax_ng)
+
+
 def validate_against_schema(parser, error, view, document, schema_path):
     """Validate document against schema using parser and throw error if
     validation fails."""
 
-    current_file = view.file_name()
+    file = _resolve_schema_path(view, schema_path)
 
-    # If the schema file URL is a relative URL and the file doesn't have
-    # a name (as in, it hasn't been saved), bail out.
-    if utils.is_relative_path(schema_path) and not current_file:
+    if file is None:
         return False
 
-    file = utils.resolve_file_path(schema_path, current_file)
-
     try:
-        validator = _get_validator(file, parser, file=file)
-        return validate(view, document, validator)
+        validator, lock = _get_validator(file, parser, file=file)
+        _set_content_model(view, file, parser, validator)
+        return validate(view, document, validator, lock)
     except (error, etree.XSLTApplyError) as e:
         vu.show_error(view, e)
         return False
@@ -64,24 +83,62 @@ def get_validator_for_namespace(namespace):
     will return a validator that can validate against a RelaxNG schema."""
     fn = validate_against_schema
 
-    if namespace == isoschematron.RELAXNG_NS:
+    if namespace == namespaces.RELAXNG:
         return partial(fn, etree.RelaxNG, etree.RelaxNGParseError)
-    elif namespace == isoschematron.XML_SCHEMA_NS:
+    elif namespace == namespaces.XML_SCHEMA:
         return partial(fn, etree.XMLSchema, etree.XMLSchemaParseError)
-    elif namespace == isoschematron.SCHEMATRON_NS:
-        return partial(fn, isoschematron.Schematron,
+    elif namespace == namespaces.SCHEMATRON:
+        if exalt.get_setting(settings.INCREMENTAL_SCHEMATRON, False):
+            return validate_against_schematron_incrementally
+
+        return partial(fn, _get_isoschematron().Schematron,
                        etree.SchematronParseError)
     elif namespace == namespaces.PRE_ISO_SCHEMATRON:
         return partial(fn, etree.Schematron, etree.SchematronParseError)
 
 
+def validate_against_schematron_incrementally(view, document, schema_path):
+    """Validate document against an ISO Schematron schema, only rerunning
+    the patterns of the schema that apply to the parts of the document that
+    have changed since the last time the document in the view was
+    validated."""
+    file = _resolve_schema_path(view, schema_path)
+
+    if file is None:
+        return False
+
+    incremental = partial(schematron.IncrementalSchematron,
+                          _get_isoschematron().Schematron)
+
+    try:
+        validator, lock = _get_validator((schematron.KEY, file), incremental,
+                                         file=file)
+
+        with lock:
+            findings = validator.validate(view.id(), document)
+    except (etree.SchematronParseError, etree.XSLTApplyError) as e:
+        vu.show_error(view, e)
+        return False
+
+    if not findings:
+        return declare_valid(view)
+
+    locator = _get_locator(view, document)
+    records = [(_get_finding_point(view, document, finding, locator),
+                finding.message)
+               for finding in findings]
+
+    vu.show_error_records(view, findings[0].message, records)
+    return True
+
+
 def validate_against_xml_schema(view, document, mode="namespace"):
     schema_file = _get_xml_schema_instance(document, mode)
 
     if schema_file is None:
         return False
 
-    validator = get_validator_for_namespace(isoschematron.XML_SCHEMA_NS)
+    validator = get_validator_for_namespace(namespaces.XML_SCHEMA)
     return validator(view, document, schema_file)
 
 
@@ -99,9 +156,10 @@ def validate_against_dtd(view, document):
     if internal_subset.external_id is None and system_url is not None:
         try:
             file = utils.resolve_file_path(system_url, view.file_name())
-            validator = _get_validator(system_url, etree.DTD, file=file)
+            validator, lock = _get_validator(file, etree.DTD, file=file)
+            _set_content_model(view, file, etree.DTD, validator)
 
-            return validate(view, document, validator)
+            return validate(view, document, validator, lock)
         except etree.DTDParseError as e:
             vu.show_error(view, e)
             return False
@@ -110,20 +168,42 @@ def validate_against_dtd(view, document):
         id = bytes(internal_subset.external_id, encodings.UTF8)
 
         try:
-            validator = _get_validator(id, etree.DTD, external_id=id)
-            return validate(view, document, validator)
+            validator, lock = _get_validator(id, etree.DTD, external_id=id)
+            _set_content_model(view, id, etree.DTD, validator)
+            return validate(view, document, validator, lock)
         except etree.DTDParseError as e:
             vu.show_error(view, e)
             return False
     else:
         # <!DOCTYPE people_list [ <!ELEMENT people_list (person)*> ]>
         try:
+            _set_content_model(view, None, etree.DTD, internal_subset)
             return validate(view, document, internal_subset)
         except etree.DTDParseError as e:
             vu.show_error(view, e)
             return False
 
 
+def validate_against_association(view, document, association):
+    """Validate a document against the schema a schema association rule
+    associates it with."""
+    if association.schema_type == "dtd":
+        return validate_against_schema(etree.DTD,
+                                       etree.DTDParseError,
+                                       view,
+                                       document,
+                                       association.schema)
+
+    validator = get_validator_for_namespace(association.schema_type)
+
+    if validator is None:
+        vu.set_status(view, messages.UNKNOWN_SCHEMA_TYPE %
+                      association.schema_type)
+        return False
+
+    return validator(view, document, association.schema)
+
+
 def try_validate(view, document):
     if not validate_against_dtd(view, document):
         if not validate_against_xml_schema(view, document,):
@@ -131,16 +211,36 @@ def try_validate(view, document):
                 return _validate_against_xml_models(view, document)
 
 
-def validate(view, document, validator):
+def forget_schemas(paths):
+    """Drop the compiled schemas of the files at the given paths from the
+    cache, along with their content models.
+
+    Schemas compiled from other files stay in the cache."""
+    paths = set(os.path.normpath(path) for path in paths)
+
+    for key in list(exalt.parser_cache):
+        if _get_schema_file(key) in paths:
+            exalt.parser_cache.pop(key, None)
+
+
+def validate(view, document, validator, lock=None):
+    """Validate the document with the validator.
+
+    If the validator is cached, lock is the lock that comes with it. A
+    validator that isn't cached isn't shared with other threads."""
     try:
-        validator.assertValid(document)
+        with lock or threading.Lock():
+            validator.assertValid(document)
         return declare_valid(view)
     except etree.DocumentInvalid as e:
-        if type(validator) == isoschematron.Schematron:
+        if _is_iso_schematron(validator):
             message = _get_schematron_error_message(e)
+            describe = _describe_schematron_error
         else:
             message = e
-        vu.show_error(view, message, validator.error_log[0])
+            describe = None
+        locate = _get_locator(view, document).locate
+        vu.show_errors(view, message, e.error_log, describe, locate)
         return True
     except OSError:
         vu.set_status(view, messages.SCHEMA_RESOLVE_ERROR % id)
@@ -151,12 +251,31 @@ def declare_valid(view):
     """Declare the document valid.
 
     Remove any highlight regions and indicate validity in status bar."""
-    view.erase_regions(constants.PLUGIN_NAME)
+    vu.clear_errors(view)
     vu.set_status(view, messages.VALID_MARKUP)
     vu.reset_status(view)
     return True
 
 
+def declare_well_formed(view):
+    """Declare the document well-formed without having validated it against
+    a schema.
+
+    A well-formed document can still be invalid, so the errors from the last
+    time the document was validated against its schema stay until it's
+    validated again."""
+    index = vu.get_error_index(view)
+
+    if vu.has_validation_errors(view):
+        vu.set_status(view, messages.WELL_FORMED_BUT_INVALID % len(index))
+        return True
+
+    vu.clear_errors(view)
+    vu.set_status(view, messages.WELL_FORMED_MARKUP)
+    vu.reset_status(view)
+    return True
+
+
 ###########
 # PRIVATE #
 ###########
@@ -169,13 +288,113 @@ def _get_validator(id, parser, **kwargs):
     return a cached validator if there's one or make a new one if there
     isn't.
 
+    The validator comes with the lock that must be held while it's
+    validating a document, as a (validator, lock) pair. The lock is cached
+    with the validator, so it goes away when the validator does.
+
     This is probably a pretty stupid way of caching parsers. Suggestions
     appreciated."""
-    validator = exalt.parser_cache.get(id) \
-        if id in exalt.parser_cache else parser(**kwargs)
+    entry = exalt.parser_cache.get(id)
+
+    if entry is None:
+        entry = exalt.parser_cache.setdefault(
+            id, (parser(**kwargs), threading.Lock())
+        )
+
+    return entry
+
+
+def _set_content_model(view, id, parser, validator):
+    """Make the content model of the schema with the given identifier
+    available for completions in the view.
+
+    The content model is extracted the first time a document is validated
+    against the schema and cached next to the compiled schema. Internal DTD
+    subsets have no identifier, so their content models aren't cached."""
+    if not exalt.get_setting(settings.SCHEMA_COMPLETIONS, True):
+        return
+
+    key = (contentmodel.KEY, id)
+    model = exalt.parser_cache.get(key) if id is not None else None
+
+    if model is None:
+        try:
+            model = contentmodel.extract(parser, id, validator)
+        except (OSError, etree.XMLSyntaxError):
+            model = None
+
+        if model is None:
+            exalt.content_models.pop(view.id(), None)
+            return
+
+        if id is not None:
+            exalt.parser_cache[key] = model
+
+    exalt.content_models[view.id()] = model
+
+
+def _get_schema_file(key):
+    """Get the local path of the schema file a parser cache key stands for,
+    or None if the key doesn't stand for a local file."""
+    if isinstance(key, tuple):
+        return _get_schema_file(key[1])
+
+    if not isinstance(key, str):
+        return None
+
+    url = urlparse(key)
+
+    if url.scheme == "file":
+        return os.path.normpath(urllib.url2pathname(url.path))
+    elif os.path.isabs(key):
+        return os.path.normpath(key)
+    else:
+        return None
 
-    exalt.parser_cache.setdefault(id, validator)
-    return validator
+
+def _get_locator(view, document):
+    return locations.Locator(document, partial(vu.get_content, view))
+
+
+def _get_finding_point(view, document, finding, locator):
+    point = view.text_point(schematron.get_line(document, finding) - 1, 0)
+
+    if vu.is_long_line(view, point):
+        located = locator.locate_path(finding.location)
+
+        if located is not None:
+            return located
+
+    return point
+
+
+def _resolve_schema_path(view, schema_path):
+    """Get the path of the schema at schema_path relative to the file in the
+    view, or None if the schema path is relative and the view has no file."""
+    current_file = view.file_name()
+
+    # If the schema file URL is a relative URL and the file doesn't have
+    # a name (as in, it hasn't been saved), bail out.
+    if utils.is_relative_path(schema_path) and not current_file:
+        return None
+
+    return utils.resolve_file_path(schema_path, current_file)
+
+
+def _get_isoschematron():
+    """Import lxml.isoschematron.
+
+    Importing lxml.isoschematron compiles a set of XSLT stylesheets, so we
+    only import it once we come across a Schematron schema."""
+    return exalt.measure("lxml.isoschematron",
+                         importlib.import_module,
+                         "lxml.isoschematron")
+
+
+def _is_iso_schematron(validator):
+    cls = type(validator)
+    return cls.__module__ == "lxml.isoschematron" and \
+        cls.__name__ == "Schematron"
 
 
 def _get_xml_schema_instance(document, mode):
@@ -213,16 +432,20 @@ def _get_schematron_error_message(error):
     xml = etree.parse(io.StringIO(str(error)))
 
     return xml.xpath("//svrl:text[1]//node()",
-                     namespaces={"svrl": isoschematron.SVRL_NS})[0]
+                     namespaces={"svrl": namespaces.SVRL})[0]
+
+
+def _describe_schematron_error(error):
+    return _get_schematron_error_message(error.message)
 
 
 def _get_validator_for_extension(extension):
     if extension == ".xsd":
-        return get_validator_for_namespace(isoschematron.XML_SCHEMA_NS)
+        return get_validator_for_namespace(namespaces.XML_SCHEMA)
     elif extension == ".rng":
-        return get_validator_for_namespace(isoschematron.RELAXNG_NS)
+        return get_validator_for_namespace(namespaces.RELAXNG)
     elif extension == ".sch":
-        return get_validator_for_namespace(isoschematron.SVRL_NS)
+        return get_validator_for_namespace(namespaces.SCHEMATRON)
     else:
         return None
 
@@ -0,0 +1,132 @@
+"""Evaluate XPath expressions against the document in a view."""
+
+import threading
+
+from lxml import etree
+
+import Exalt.exalt as exalt
+import Exalt.messages as messages
+import Exalt.settings as settings
+import Exalt.view as vu
+
+import Exalt.impl.parsetools as parsetools
+
+# The maximum number of characters of a result to show in the quick panel.
+PREVIEW_LENGTH = 80
+
+_cache_lock = threading.Lock()
+
+
+class Cancelled(Exception):
+    pass
+
+
+def get_namespaces(tree):
+    """Get the namespace prefixes to use in XPath expressions for the tree.
+
+    The prefixes the root element declares are always available. The
+    xpath_namespaces setting can add more or override them. The default
+    namespace doesn't have a prefix, so you need to give it one in the
+    setting to be able to use it."""
+    namespaces = {prefix: uri for prefix, uri in tree.getroot().nsmap.items()
+                  if prefix is not None}
+
+    namespaces.update(exalt.get_setting(settings.XPATH_NAMESPACES, {}))
+    return namespaces
+
+
+def compile_xpath(expression, namespaces):
+    """Get a compiled XPath object for the expression.
+
+    Compiled expressions are kept in an LRU cache keyed by the expression
+    and the namespaces, so that rerunning a query doesn't compile it
+    again."""
+    key = (expression, tuple(sorted(namespaces.items())))
+
+    with _cache_lock:
+        compiled = exalt.xpath_cache.get(key)
+
+        if compiled is not None:
+            exalt.xpath_cache.move_to_end(key)
+            return compiled
+
+    compiled = etree.XPath(expression, namespaces=namespaces)
+
+    with _cache_lock:
+        exalt.xpath_cache[key] = compiled
+
+    return compiled
+
+
+def evaluate(view, expression, is_cancelled):
+    """Evaluate the expression against the document in the view and get a
+    (label, line) pair for every result.
+
+    The line is None for results that don't come from a node with a known
+    location. libxml2 can't stop an XPath evaluation midway, so is_cancelled
+    is only checked before and after the evaluation and while formatting the
+    results. If it returns True, raise Cancelled."""
+    profile = "validate" if vu.is_xml(view) else "format"
+    tree = parsetools.parse_view(view, profile, from_file=True)
+
+    if is_cancelled():
+        raise Cancelled()
+
+    compiled = compile_xpath(expression, get_namespaces(tree))
+    result = compiled(tree)
+
+    if not isinstance(result, list):
+        return [(_preview(str(result)), None)]
+
+    limit = exalt.get_setting(settings.XPATH_MAX_RESULTS, 10000)
+    items = []
+
+    for node in result[:limit]:
+        if is_cancelled():
+            raise Cancelled()
+
+        items.append(describe(node))
+
+    if len(result) > limit:
+        items.append((messages.XPATH_TOO_MANY_RESULTS % (limit, len(result)),
+                      None))
+
+    return items
+
+
+def describe(node):
+    """Get a (label, line) pair for a single XPath result."""
+    if isinstance(node, etree._Element):
+        if isinstance(node.tag, str):
+            label = "<%s> %s" % (etree.QName(node).localname,
+                                 " ".join((node.text or "").split()))
+        else:
+            label = etree.tostring(node, encoding=str, with_tail=False)
+
+        return _preview(label), node.sourceline
+
+    if isinstance(node, tuple):
+        # A namespace node.
+        return _preview("xmlns:%s=\"%s\"" % node), None
+
+    parent = node.getparent() if hasattr(node, "getparent") else None
+    line = parent.sourceline if parent is not None else None
+
+    if getattr(node, "is_attribute", False):
+        label = "@%s=\"%s\"" % (etree.QName(node.attrname).localname, node)
+    else:
+        label = str(node)
+
+    return _preview(" ".join(label.split())), line
+
+
+###########
+# PRIVATE #
+###########
+
+
+def _preview(text):
+    if len(text) > PREVIEW_LENGTH:
+        return text[:PREVIEW_LENGTH - 1] + "…"
+
+    return text
@@ -1,6 +1,53 @@
 INITIALIZING = "Initializing %s..."
 VALID_MARKUP = "Valid markup"
+WELL_FORMED_MARKUP = "Well-formed markup (schema validation on save)"
+WELL_FORMED_BUT_INVALID = "Well-formed markup, %d errors from last validation"
+LARGE_DOCUMENT_MODE = "Exalt: large document mode"
 NOT_WELL_FORMED_XML = "XML not well-formed, can't format"
 SCHEMA_RESOLVE_ERROR = "Can't resolve schema \"%s\""
+UNKNOWN_SCHEMA_TYPE = "Unknown schema type \"%s\""
+INVALID_ASSOCIATION = "Exalt: Schema association has no schema: %s"
+INVALID_ASSOCIATIONS = "Exalt: Ignored %d schema associations, see console"
+XPATH_PROMPT = "XPath:"
+XPATH_EVALUATING = "Evaluating XPath..."
+XPATH_CANCELLED = "XPath evaluation cancelled"
+XPATH_NO_RESULTS = "XPath: no results"
+XPATH_ERROR = "XPath error: %s"
+XPATH_LINE = "Line %d"
+XPATH_TOO_MANY_RESULTS = "Showing the first %d of %d results"
+TRANSFORM_STYLESHEET_PROMPT = "Stylesheet:"
+TRANSFORM_SOURCE_PROMPT = "Document to transform:"
+TRANSFORMING = "Transforming..."
+TRANSFORM_RESULT = "Transformation result"
+TRANSFORM_PROFILE = "Transformation profile"
+TRANSFORM_DONE = "Transformed in %.3f s"
+TRANSFORM_ERROR = "Can't transform: %s"
+FRAGMENTS_CHECKING = "Checking documents..."
+FRAGMENTS_FORMATTING = "Formatting documents..."
+FRAGMENTS_CHANGED = "The file changed while formatting, not replacing it"
+FRAGMENTS_FORMATTED = "Formatted %d documents"
+FRAGMENTS_WELL_FORMED = "All %d documents are well-formed"
+FRAGMENT_ERRORS = "%d of %d documents aren't well-formed: %s"
+FRAGMENT_ERROR = "Document %d: %s"
+XINCLUDE_ERROR = "Can't process XIncludes: %s"
+DEPENDENTS_HEADER = "Validating %d files that depend on %s\n\n"
+DEPENDENT_OPEN = "%s: Open, validating in its view\n"
+DEPENDENT_STATUS = "%s: %s\n"
+DEPENDENT_ERROR = "%s:%d: %s\n"
 CANNOT_PARSE_EXCEPTION = "This ain't valid markup, won't parse"
 NO_PARSER_FOR_SYNTAX = "Can't find a parser for %s, aborting."
+ERROR_POSITION = "Error %d of %d: %s"
+ERROR_LOCATION = "Line %d, column %d: %s"
+OUTLINE_BUILDING = "Indexing elements..."
+LINT_ERROR = "%s, line %d"
+LINT_INVALID_MARKUP = "Invalid markup"
+LINT_INVALID_REFERENCE = "Unescaped '&' or invalid entity reference"
+LINT_CONTENT_OUTSIDE_ROOT = "Content is not allowed outside the root element"
+LINT_EXTRA_CONTENT = "Extra content at the end of the document"
+LINT_UNEXPECTED_END_TAG = "Unexpected end tag </%s>"
+LINT_TAG_MISMATCH = "Opening and ending tag mismatch: %s and %s"
+LINT_UNCLOSED_TAG = "Premature end of data in tag %s"
+LINT_NO_ROOT = "Start tag expected, '<' not found"
+STARTUP_REPORT = "Exalt startup report"
+FIRST_VALIDATION = "first validation (since plugin load)"
+NO_VALIDATION_YET = "No document has been validated yet."
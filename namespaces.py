@@ -1,2 +1,7 @@
 XSI = "http://www.w3.org/2001/XMLSchema-instance"
 PRE_ISO_SCHEMATRON = "http://www.ascc.net/xml/schematron"
+RELAXNG = "http://relaxng.org/ns/structure/1.0"
+XML_SCHEMA = "http://www.w3.org/2001/XMLSchema"
+SCHEMATRON = "http://purl.oclc.org/dsdl/schematron"
+SVRL = "http://purl.oclc.org/dsdl/svrl"
+XSLT = "http://www.w3.org/1999/XSL/Transform"
@@ -1,2 +1,18 @@
 AUTO_SCROLL_TO_ERROR = "auto_scroll_to_error"
 XML_CATALOG_FILES = "xml_catalog_files"
+LINT_WHILE_TYPING = "lint_while_typing"
+LINT_CHECKPOINT_INTERVAL = "lint_checkpoint_interval"
+IDLE_VALIDATION_DELAY = "idle_validation_delay"
+DOCUMENT_CACHE_MAX_SIZE = "document_cache_max_size"
+VALIDATION_CONCURRENCY = "validation_concurrency"
+LARGE_DOCUMENT_SIZE = "large_document_size"
+PROCESS_XINCLUDE = "process_xinclude"
+VALIDATE_DEPENDENTS = "validate_dependents"
+DEPENDENCY_FILE_EXTENSIONS = "dependency_file_extensions"
+SCHEMA_ASSOCIATIONS = "schema_associations"
+XPATH_NAMESPACES = "xpath_namespaces"
+XPATH_MAX_RESULTS = "xpath_max_results"
+XSLT_PARAMETERS = "xslt_parameters"
+SCHEMA_COMPLETIONS = "schema_completions"
+INCREMENTAL_SCHEMATRON = "incremental_schematron"
+LONG_LINE_LENGTH = "long_line_length"
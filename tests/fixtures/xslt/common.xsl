@@ -0,0 +1,7 @@
+<?xml version="1.0" encoding="UTF-8"?>
+<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+  <xsl:template match="name">
+    <xsl:value-of select="."/>
+    <xsl:text>!</xsl:text>
+  </xsl:template>
+</xsl:stylesheet>
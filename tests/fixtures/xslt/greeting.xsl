@@ -0,0 +1,15 @@
+<?xml version="1.0" encoding="UTF-8"?>
+<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+  <xsl:import href="common.xsl"/>
+
+  <xsl:output method="text"/>
+
+  <xsl:param name="greeting" select="'Hello'"/>
+
+  <xsl:template match="/person">
+    <xsl:message>Greeting <xsl:value-of select="name"/></xsl:message>
+    <xsl:value-of select="$greeting"/>
+    <xsl:text>, </xsl:text>
+    <xsl:apply-templates select="name"/>
+  </xsl:template>
+</xsl:stylesheet>
@@ -1,6 +1,8 @@
 import sublime
 import sys
 import os
+import threading
+import io
 
 from unittest import TestCase
 
@@ -8,8 +10,30 @@ exalt = sys.modules["Exalt.exalt"]
 
 import Exalt.constants as constants
 import Exalt.messages as messages
+import Exalt.namespaces as namespaces
+import Exalt.view as vu
 import Exalt.impl.plugin as plugin
 
+# Exalt loads lxml lazily, and XML_CATALOG_FILES must be set before lxml is
+# loaded.
+plugin.load()
+
+from lxml import etree
+
+import Exalt.impl.linter as linter
+import Exalt.impl.parsetools as parsetools
+import Exalt.impl.scheduler as scheduler
+import Exalt.impl.includes as includes
+import Exalt.impl.dependencies as dependencies
+import Exalt.impl.associations as associations
+import Exalt.impl.xpath as xpath
+import Exalt.impl.transform as transform
+import Exalt.impl.contentmodel as contentmodel
+import Exalt.impl.completions as completions
+import Exalt.impl.schematron as schematron
+import Exalt.impl.fragments as fragments
+import Exalt.impl.locations as locations
+
 # NOTE: These unit tests require that you've cloned the
 # https://github.com/eerohele/catalogs repo (or an otherwise sufficient
 # set of XML catalogs) and have set up Exalt to use those catalogs.
@@ -90,9 +114,20 @@ class TestExaltPlugin(TestCase):
         )
 
 
+class ImmediateQueue:
+    """A validation queue that runs every job right away on the calling
+    thread."""
+    def submit(self, view, function):
+        function(view)
+
+    def defer_background(self, delay):
+        pass
+
+
 class ExaltTestCase(TestCase):
     def setUpClass():
-        plugin.invoke_async = sublime.set_timeout
+        ExaltTestCase.queue = plugin.queue
+        plugin.queue = ImmediateQueue()
 
     def setUp(self):
         self.view = sublime.active_window().new_file()
@@ -106,7 +141,7 @@ class ExaltTestCase(TestCase):
             self.view.window().run_command("close_file")
 
     def tearDownClass():
-        plugin.invoke_async = sublime.set_timeout_async
+        plugin.queue = ExaltTestCase.queue
 
     def set_html_syntax(self):
         self.view.set_syntax_file("Packages/HTML/HTML.tmLanguage")
@@ -127,9 +162,9 @@ class ExaltTestCase(TestCase):
 
 
 class TestExaltFormatCommand(ExaltTestCase):
-    def run_command_and_compare(self, command, content, after):
+    def run_command_and_compare(self, command, content, after, args=None):
         self.add_content_to_view(content)
-        self.view.run_command(command)
+        self.view.run_command(command, args)
         self.assertEqual(self.get_view_content(), after)
 
     def test_canonicalize_xml_document(self):
@@ -138,6 +173,25 @@ class TestExaltFormatCommand(ExaltTestCase):
 
         self.run_command_and_compare("exalt_canonicalize_document", content, after)
 
+    def test_canonicalize_xml_document_exclusive_with_comments(self):
+        content = """<a xmlns:x="urn:x" d="e" b="c"><!-- c --></a>"""
+        after = """<a b="c" d="e"><!-- c --></a>"""
+
+        self.run_command_and_compare("exalt_canonicalize_document",
+                                     content,
+                                     after,
+                                     {"exclusive": True,
+                                      "with_comments": True})
+
+    def test_canonicalize_xml_document_c14n_2(self):
+        content = """<a d="e" b="c"><!-- c --><b>&#233;</b></a>"""
+        after = """<a b="c" d="e"><b>\u00e9</b></a>"""
+
+        self.run_command_and_compare("exalt_canonicalize_document",
+                                     content,
+                                     after,
+                                     {"version": "2.0"})
+
     def test_format_xml_document(self):
         content = """<pokemon><name>Pikachu</name><level>1</level></pokemon>"""
         after = """<?xml version='1.0' encoding='UTF-8'?>
@@ -346,3 +400,738 @@ class TestExaltValidateCommand(ValidateTestCase):
     def test_validate_xml_non_well_formed(self):
         self.validate_content_and_assert_status(NON_WELL_FORMED_XML,
                                                 "error parsing attribute name, line 11, column 5 (<string>, line 11)")
+
+
+class TestExaltErrorNavigation(ValidateTestCase):
+    CONTENT = """<!DOCTYPE a [<!ELEMENT a (#PCDATA)>]>
+<a><b/>
+<c/></a>"""
+
+    def test_validate_keeps_all_errors(self):
+        self.validate_content_and_assert_status(
+            self.CONTENT,
+            "Element a was declared #PCDATA but contains non text nodes, line 2"
+        )
+
+        self.assertEqual(len(exalt.error_indexes[self.view.id()]), 3)
+
+    def test_next_and_previous_error(self):
+        self.add_content_to_view(self.CONTENT)
+        self.view.run_command("exalt_validate")
+
+        index = exalt.error_indexes[self.view.id()]
+
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(0))
+        self.view.run_command("exalt_next_error")
+        self.assertEqual(self.view.sel()[0].begin(), index.points[0])
+
+        self.view.run_command("exalt_previous_error")
+        self.assertEqual(self.view.sel()[0].begin(), index.points[-1])
+
+
+class TestExaltMinifiedErrors(ValidateTestCase):
+    CONTENT = "<!DOCTYPE a [<!ELEMENT a (b)*><!ELEMENT b EMPTY>" \
+        "<!ELEMENT c EMPTY>]><a><!-- <c/> -->" + "<b/>" * 300 + "<c/></a>"
+
+    def test_validation_error_points_at_element(self):
+        self.add_content_to_view(self.CONTENT)
+        self.view.run_command("exalt_validate")
+
+        index = exalt.error_indexes[self.view.id()]
+        region = vu.get_error_region(self.view, index.points[0])
+
+        self.assertEqual(self.view.substr(region), "<a>")
+
+    def test_syntax_error_highlights_token(self):
+        self.add_content_to_view("<a>" + "<b>x</b>" * 300 + "<c></d></a>")
+        self.view.run_command("exalt_validate")
+
+        index = exalt.error_indexes[self.view.id()]
+        region = vu.get_error_region(self.view, index.points[0])
+
+        self.assertEqual(self.view.substr(region), "</d>")
+
+    def test_get_token_bounds(self):
+        self.assertEqual(vu.get_token_bounds("<a>xyz</a>", 4), (3, 6))
+        self.assertEqual(vu.get_token_bounds("<a>xyz</a>", 3), (0, 3))
+        self.assertEqual(vu.get_token_bounds("<a>xyz</a>", 7), (6, 10))
+
+    def test_locator_skips_markup_that_is_not_a_start_tag(self):
+        text = "<a><!-- <b/> --><![CDATA[<b/>]]><?pi <b/>?><b/></a>"
+        document = etree.ElementTree(etree.fromstring(text))
+        locator = locations.Locator(document, lambda: text)
+
+        self.assertEqual(locator.locate_path("/a/b"), text.rindex("<b/>"))
+        self.assertIsNone(locator.locate_path("/a/c"))
+
+
+class TestExaltLinter(TestCase):
+    def lint(self, text):
+        checker = linter.Linter(8)
+        checker.update(text)
+        return checker
+
+    def test_lint_well_formed(self):
+        self.assertEqual(self.lint("<a><b>c</b><d/></a>").errors(), [])
+
+    def test_lint_tag_mismatch(self):
+        self.assertEqual(
+            self.lint("<a><b>c</d></a>").errors(),
+            [(7, "Opening and ending tag mismatch: b and d"),
+             (11, "Opening and ending tag mismatch: b and a")]
+        )
+
+    def test_lint_incremental_matches_full_lint(self):
+        before = "<a>" + "<b>text &amp; more</b>" * 50 + "</a>"
+        after = before[:200] + "<c>" + before[200:]
+
+        checker = self.lint(before)
+        checker.update(after)
+
+        self.assertEqual(checker.errors(), self.lint(after).errors())
+
+
+class TestExaltOutline(TestCase):
+    DOCUMENT = "<r><a id='x'><b xml:id=\"y\"/>text</a><c></r>"
+
+    def get_outline(self, text, interval=4):
+        checker = linter.Linter(interval)
+        checker.update(text)
+        return checker.outline()
+
+    def get_element(self, outline, i):
+        return self.DOCUMENT[outline.start(i):outline.end(i)]
+
+    def get_names(self, outline):
+        return [outline.name(i) for i in range(len(outline))]
+
+    def test_elements(self):
+        outline = self.get_outline(self.DOCUMENT)
+
+        self.assertEqual(self.get_names(outline), ["r", "a", "b", "c"])
+        self.assertEqual(outline.get_path(2), "/r/a/b")
+        self.assertEqual(self.get_element(outline, 1),
+                         "<a id='x'><b xml:id=\"y\"/>text</a>")
+        self.assertEqual(outline.ids(), {"x": 1, "y": 2})
+
+    def test_unclosed_element_ends_at_parent_end_tag(self):
+        outline = self.get_outline(self.DOCUMENT)
+        self.assertEqual(self.get_element(outline, 3), "<c>")
+
+    def test_enclosing(self):
+        outline = self.get_outline(self.DOCUMENT)
+        point = self.DOCUMENT.index("text")
+
+        i = outline.enclosing(point, point)
+        self.assertEqual(outline.name(i), "a")
+
+        i = outline.enclosing(outline.start(i), outline.end(i))
+        self.assertEqual(outline.name(i), "r")
+
+    def test_outline_follows_edits(self):
+        checker = linter.Linter(4)
+        checker.update(self.DOCUMENT)
+        checker.outline()
+        checker.update(self.DOCUMENT.replace("<c>", "<d id='z'/>"))
+
+        outline = checker.outline()
+        self.assertEqual(self.get_names(outline), ["r", "a", "b", "d"])
+        self.assertEqual(outline.ids()["z"], 3)
+
+    def test_edit_only_collects_changed_segments_again(self):
+        text = "<r>" + "<a>x</a>" * 100 + "</r>"
+        checker = linter.Linter(64)
+        checker.update(text)
+        before = checker.outline()
+
+        checker.update(text[:-10] + "<b/>" + text[-10:])
+        after = checker.outline()
+
+        self.assertIs(after.parts[0], before.parts[0])
+        self.assertIsNot(after.parts[-1], before.parts[-1])
+        self.assertEqual(after.get_path(len(after) - 1), "/r/b")
+
+
+class TestExaltDocumentCache(ExaltTestCase):
+    def test_format_reuses_canonicalized_tree(self):
+        self.add_content_to_view("<a><b/></a>")
+        tree = parsetools.parse_view(self.view, "canonicalize")
+        self.assertIs(parsetools.parse_view(self.view, "format"), tree)
+
+    def test_changing_view_invalidates_tree(self):
+        self.add_content_to_view("<a><b/></a>")
+        tree = parsetools.parse_view(self.view, "validate")
+        self.clear_view()
+        self.add_content_to_view("<a><c/></a>")
+        self.assertIsNot(parsetools.parse_view(self.view, "validate"), tree)
+
+
+class TestExaltLargeDocument(ValidateTestCase):
+    DEEP = "<a>" * 300 + "</a>" * 300
+
+    def setUp(self):
+        super().setUp()
+        self.settings = exalt.get_settings()
+        self.settings.set("large_document_size", 100)
+
+    def tearDown(self):
+        self.settings.erase("large_document_size")
+        super().tearDown()
+
+    def test_validate_deeply_nested_document(self):
+        self.validate_content_and_assert_status(self.DEEP,
+                                                messages.VALID_MARKUP)
+
+    def test_lean_validation_only_checks_well_formedness(self):
+        self.add_content_to_view(self.DEEP)
+        self.view.run_command("exalt_validate", {"lean": True})
+        self.assertEqual(self.view.get_status(constants.PLUGIN_NAME),
+                         messages.WELL_FORMED_MARKUP)
+        self.assertEqual(self.view.get_status(constants.MODE_STATUS_KEY),
+                         messages.LARGE_DOCUMENT_MODE)
+
+    def test_lean_validation_keeps_schema_errors(self):
+        self.add_content_to_view("<!DOCTYPE a [<!ELEMENT a EMPTY>]>" +
+                                 "<a><b/></a>" + " " * 100)
+        self.view.run_command("exalt_validate")
+        index = exalt.error_indexes[self.view.id()]
+
+        self.view.run_command("exalt_validate", {"lean": True})
+        self.assertIs(exalt.error_indexes[self.view.id()], index)
+        self.assertEqual(self.view.get_status(constants.PLUGIN_NAME),
+                         messages.WELL_FORMED_BUT_INVALID % len(index))
+
+    def test_large_document_is_not_cached(self):
+        self.add_content_to_view(self.DEEP)
+        tree = parsetools.parse_view(self.view, "validate")
+        self.assertIsNot(parsetools.parse_view(self.view, "validate"), tree)
+
+
+class TestExaltIncrementalSchematron(ValidateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.settings = exalt.get_settings()
+        self.settings.set("incremental_schematron", True)
+
+        path = os.path.join(exalt.get_plugin_path(),
+                            "tests/fixtures/schemas/rules.sch")
+
+        from lxml import isoschematron
+        self.schema = schematron.IncrementalSchematron(
+            isoschematron.Schematron, path
+        )
+
+        self.runs = []
+
+        for i, pattern in enumerate(self.schema.patterns):
+            pattern.run = self.count_runs(i, pattern.run)
+
+    def tearDown(self):
+        self.settings.erase("incremental_schematron")
+        super().tearDown()
+
+    def count_runs(self, i, run):
+        def counting_run(document):
+            self.runs.append(i)
+            return run(document)
+
+        return counting_run
+
+    def document(self, para="Long enough"):
+        return etree.fromstring(
+            "<doc><section id='a'><title>A</title><para>%s</para></section>"
+            "<section id='b'><title>B</title><para>Long enough</para>"
+            "</section></doc>" % para
+        ).getroottree()
+
+    def test_only_changed_patterns_run_again(self):
+        self.assertEqual(self.schema.validate(1, self.document()), [])
+        self.assertEqual(self.runs, [0, 1, 2, 3])
+
+        del self.runs[:]
+        findings = self.schema.validate(1, self.document(para="No"))
+
+        # The pattern that looks at preceding sections always runs.
+        self.assertEqual(self.runs, [0, 1, 2, 3])
+        self.assertEqual([f.message for f in findings],
+                         ["This paragraph is too short"])
+
+        del self.runs[:]
+        self.schema.validate(1, self.document(para="No"))
+
+        self.assertEqual(self.runs, [2])
+
+    def test_patterns_share_fingerprints(self):
+        document = self.document()
+        fingerprints = {}
+
+        self.schema.patterns[0].get_signature(document, fingerprints)
+        count = len(fingerprints)
+
+        # Another pattern with the same context reuses the fingerprints.
+        self.schema.patterns[3].get_signature(document, fingerprints)
+
+        self.assertGreater(count, 0)
+        self.assertEqual(len(fingerprints), count)
+
+    def test_validate_xml_invalid_iso_schematron(self):
+        self.validate_content_and_assert_status(
+            INVALID_ISO_SCHEMATRON, "This section has no paragraphs"
+        )
+
+
+class TestExaltFragments(ExaltTestCase):
+    STREAM = "INFO <?xml version=\"1.0\"?><a><a/></a>\n<b x=\"/>\"/>\n\n<c>"
+
+    def test_split(self):
+        self.assertEqual([self.STREAM[begin:end] for begin, end
+                          in fragments.split(self.STREAM)],
+                         ["<?xml version=\"1.0\"?><a><a/></a>",
+                          "<b x=\"/>\"/>",
+                          "<c>"])
+
+    def test_get_offset(self):
+        self.assertEqual(fragments.get_offset("ab\ncd\nef", 3, 2), 7)
+
+    def test_split_skips_log_text(self):
+        text = "a < b, x <- y <= z\n<a/>"
+        self.assertEqual(fragments.split(text), [(text.index("<a/>"),
+                                                  len(text))])
+
+    def test_split_skips_unclosed_tags_in_stack_traces(self):
+        text = "INFO <a><b>1</b></a>\n" \
+            "ERROR\n\tat com.Foo.<init>(Foo.java:1)\n" \
+            "INFO <c><d>2</d></c>\n<e><f/></e>\n"
+
+        self.assertEqual([text[begin:end] for begin, end
+                          in fragments.split(text)],
+                         ["<a><b>1</b></a>", "<c><d>2</d></c>", "<e><f/></e>"])
+
+    def test_format_fragments(self):
+        formatted, count, records = self.format(
+            "<a><b/></a>\n<c><d>x</e></c>"
+        )
+
+        self.assertEqual(formatted, "<a>\n  <b/>\n</a>\n<c><d>x</e></c>")
+        self.assertEqual(count, 2)
+        self.assertEqual(len(records), 1)
+        self.assertGreaterEqual(records[0][0], len("<a>\n  <b/>\n</a>\n"))
+
+    def test_format_fragments_in_plain_text_view(self):
+        self.view.set_syntax_file("Packages/Text/Plain text.tmLanguage")
+
+        formatted, count, records = self.format(
+            "12:00 a < b\n<a><b/></a>\n12:01 <-\n"
+        )
+
+        self.assertEqual(formatted,
+                         "12:00 a < b\n<a>\n  <b/>\n</a>\n12:01 <-\n")
+        self.assertEqual(count, 1)
+        self.assertEqual(records, [])
+
+    def test_check_fragments_in_plain_text_view(self):
+        self.view.set_syntax_file("Packages/Text/Plain text.tmLanguage")
+        kind, options = plugin.get_fragment_parser(self.view, "wellformed")
+
+        count, records = plugin.check_fragments("x <a/> y <b></c>",
+                                                kind, options)
+
+        self.assertEqual(count, 2)
+        self.assertEqual(len(records), 1)
+
+    def format(self, content):
+        self.add_content_to_view(content)
+        kind, options = plugin.get_fragment_parser(self.view, "format")
+        return plugin.format_fragments(self.get_view_content(), kind, options)
+
+
+class TestExaltXpath(ExaltTestCase):
+    def evaluate(self, expression):
+        return xpath.evaluate(self.view, expression, lambda: False)
+
+    def test_compiled_expression_is_cached(self):
+        compiled = xpath.compile_xpath("//a", {"p": "urn:p"})
+        self.assertIs(xpath.compile_xpath("//a", {"p": "urn:p"}), compiled)
+        self.assertIsNot(xpath.compile_xpath("//a", {}), compiled)
+
+    def test_evaluate_nodes(self):
+        self.add_content_to_view('<r xmlns:p="urn:p">\n<p:a id="x"/>\n</r>')
+        self.assertEqual(self.evaluate("//p:a/@id"), [('@id="x"', 2)])
+
+    def test_evaluate_scalar(self):
+        self.add_content_to_view("<r><a/><a/></r>")
+        self.assertEqual(self.evaluate("count(//a)"), [("2.0", None)])
+
+    def test_cancel(self):
+        self.add_content_to_view("<r/>")
+
+        with self.assertRaises(xpath.Cancelled):
+            xpath.evaluate(self.view, "/r", lambda: True)
+
+
+class TestExaltParserPool(ExaltTestCase):
+    def test_pooled_parser_is_reused(self):
+        with parsetools.pooled_parser(self.view, recover=True) as parser:
+            pass
+
+        with parsetools.pooled_parser(self.view, recover=True) as other:
+            self.assertIs(other, parser)
+
+    def test_pooled_parser_is_not_shared(self):
+        with parsetools.pooled_parser(self.view, recover=True) as parser:
+            with parsetools.pooled_parser(self.view, recover=True) as other:
+                self.assertIsNot(other, parser)
+
+
+class TestExaltScheduler(ExaltTestCase):
+    def test_active_view_has_highest_priority(self):
+        self.assertEqual(scheduler.get_priority(self.view), scheduler.ACTIVE)
+
+    def test_background_view_has_lowest_priority(self):
+        window = self.view.window()
+        other = window.new_file()
+
+        try:
+            window.focus_view(other)
+            self.assertEqual(scheduler.get_priority(self.view),
+                             scheduler.BACKGROUND)
+        finally:
+            other.set_scratch(True)
+            window.run_command("close_file")
+
+    def test_submitted_job_runs(self):
+        done = threading.Event()
+        queue = scheduler.Scheduler(lambda: 1)
+        queue.submit(self.view, lambda view: done.set())
+        self.assertTrue(done.wait(5))
+
+    def test_worker_waits_for_next_job(self):
+        threads = []
+        done = threading.Event()
+        queue = scheduler.Scheduler(lambda: 1)
+
+        def job(view):
+            threads.append(threading.current_thread())
+            done.set()
+
+        for _ in range(2):
+            done.clear()
+            queue.submit(self.view, job)
+            self.assertTrue(done.wait(5))
+
+        self.assertIs(threads[0], threads[1])
+        self.assertEqual(queue.workers, 1)
+
+
+class TestExaltParseFile(TestCase):
+    def test_parse_file_respects_declared_encoding(self):
+        path = os.path.join(exalt.get_plugin_path(),
+                            "tests/fixtures/markup/latin1.xml")
+
+        tree = parsetools.parse_file(etree.XMLParser(), path)
+
+        self.assertEqual(tree.docinfo.encoding, "ISO-8859-1")
+        self.assertEqual(tree.getroot().text, "café")
+
+
+class TestExaltIncludes(TestCase):
+    def setUp(self):
+        self.directory = os.path.join(exalt.get_plugin_path(),
+                                      "tests/fixtures/xinclude")
+
+    def test_load_caches_included_document(self):
+        path = os.path.join(self.directory, "chapter.xml")
+        first = includes.load(path, "xml", "validate")
+        cached = exalt.include_cache[path]
+        second = includes.load(path, "xml", "validate")
+
+        self.assertIs(exalt.include_cache[path], cached)
+        self.assertIsNot(first, second)
+        self.assertEqual(etree.tostring(first), etree.tostring(second))
+
+    def test_included_elements_are_on_the_line_of_their_include(self):
+        path = os.path.join(self.directory, "book.xml")
+        view = dependencies.HeadlessView(path, "XML.tmLanguage")
+        document = includes.process(view, etree.parse(path))
+
+        self.assertEqual([element.sourceline
+                          for element in document.iter("chapter", "title")],
+                         [3, 3, 4, 4])
+
+
+class TestExaltDependencyIndex(TestCase):
+    def setUp(self):
+        self.directory = os.path.join(exalt.get_plugin_path(),
+                                      "tests/fixtures/dependencies")
+        self.index = dependencies.DependencyIndex([".xml", ".xsd"])
+        self.index.refresh([self.directory])
+
+    def path(self, name):
+        return os.path.normpath(os.path.join(self.directory, name))
+
+    def test_get_references(self):
+        references = dependencies.get_references(
+            self.path("topics/topic.xml"),
+            read_file("dependencies/topics/topic.xml")
+        )
+
+        self.assertEqual(references, {self.path("schema.xsd")})
+
+    def test_get_transitive_dependents(self):
+        self.assertEqual(self.index.get_dependents(self.path("schema.xsd")),
+                         {self.path("topics/topic.xml"),
+                          self.path("map.xml")})
+
+    def test_get_schema_include_references(self):
+        references = dependencies.get_references(
+            self.path("schema.xsd"),
+            read_file("dependencies/schema.xsd")
+        )
+
+        self.assertEqual(references, {self.path("types.xsd")})
+
+    def test_get_dependents_of_included_schema(self):
+        self.assertEqual(self.index.get_dependents(self.path("types.xsd")),
+                         {self.path("schema.xsd"),
+                          self.path("topics/topic.xml"),
+                          self.path("map.xml")})
+
+    def test_file_without_dependents(self):
+        self.assertEqual(self.index.get_dependents(self.path("map.xml")),
+                         set())
+
+    def test_forget_only_saved_schemas(self):
+        saved = exalt.file_to_uri(self.path("types.xsd"))
+        other = exalt.file_to_uri(self.path("schema.xsd"))
+        keys = [saved, (contentmodel.KEY, saved), other,
+                (contentmodel.KEY, other)]
+
+        exalt.parser_cache.clear()
+
+        for key in keys:
+            exalt.parser_cache[key] = object()
+
+        plugin.validator.forget_schemas([self.path("types.xsd")])
+
+        self.assertEqual(list(exalt.parser_cache), keys[2:])
+        exalt.parser_cache.clear()
+
+
+class TestExaltTransform(TestCase):
+    def setUp(self):
+        self.directory = os.path.join(exalt.get_plugin_path(),
+                                      "tests/fixtures/xslt")
+
+    def path(self, name):
+        return os.path.normpath(os.path.join(self.directory, name))
+
+    def test_get_dependencies(self):
+        self.assertEqual(
+            set(transform.get_dependencies(self.path("greeting.xsl"))),
+            {self.path("greeting.xsl"), self.path("common.xsl")}
+        )
+
+    def test_reuses_compiled_stylesheet(self):
+        first = transform.get_stylesheet(self.path("greeting.xsl"))
+        second = transform.get_stylesheet(self.path("greeting.xsl"))
+
+        self.assertIs(first, second)
+
+    def test_transform_with_parameter(self):
+        stylesheet = transform.get_stylesheet(self.path("greeting.xsl"))
+        document = etree.parse(self.path("person.xml"))
+        result = transform.transform(stylesheet, document,
+                                     {"greeting": "Hi"})
+
+        self.assertEqual(result.text, "Hi, Ada!")
+        self.assertEqual(result.method, "text")
+        self.assertEqual(result.messages, ["Greeting Ada"])
+
+    def test_concurrent_transforms_keep_their_messages(self):
+        stylesheet = transform.get_stylesheet(self.path("greeting.xsl"))
+        document = etree.parse(self.path("person.xml"))
+        results = []
+
+        def run():
+            for _ in range(20):
+                results.append(transform.transform(stylesheet, document))
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 80)
+
+        for result in results:
+            self.assertEqual(result.messages, ["Greeting Ada"])
+
+    def test_output_method_comes_from_stylesheet(self):
+        stylesheet = transform.compile_stylesheet(etree.ElementTree(etree.XML(
+            "<xsl:stylesheet version='1.0' "
+            "xmlns:xsl='http://www.w3.org/1999/XSL/Transform'>"
+            "<xsl:output method='html'/>"
+            "<xsl:template match='/'><p>x<br/></p></xsl:template>"
+            "</xsl:stylesheet>"
+        )))
+        result = transform.transform(stylesheet, etree.XML("<a/>"))
+
+        self.assertEqual(result.method, "html")
+        self.assertEqual(result.text.strip(), "<p>x<br></p>")
+
+    def test_compile_unsaved_stylesheet_with_import(self):
+        with open(self.path("greeting.xsl"), "rb") as file:
+            document = etree.parse(io.BytesIO(file.read()))
+
+        stylesheet = transform.compile_stylesheet(document,
+                                                  self.path("greeting.xsl"))
+        result = transform.transform(stylesheet,
+                                     etree.parse(self.path("person.xml")))
+
+        self.assertEqual(result.text, "Hello, Ada!")
+        self.assertIsNone(document.docinfo.URL)
+
+
+class TestExaltContentModel(TestCase):
+    def schema(self, name):
+        return os.path.join(exalt.get_plugin_path(), "tests/fixtures/schemas",
+                            name)
+
+    def test_dtd(self):
+        dtd = etree.DTD(io.StringIO(
+            "<!ELEMENT list (item+)>"
+            "<!ELEMENT item (#PCDATA | b)*>"
+            "<!ELEMENT b (#PCDATA)>"
+            "<!ATTLIST item type (a | b) #IMPLIED>"
+        ))
+
+        model = contentmodel.from_dtd(dtd)
+
+        self.assertEqual(model.roots, ("list",))
+        self.assertEqual(model.get_children("item"), ("b",))
+        self.assertEqual(model.get_attributes("item"), {"type": ("a", "b")})
+
+    def test_relaxng(self):
+        model = contentmodel.from_relaxng(self.schema("book.rng"))
+
+        self.assertEqual(model.roots, ("book",))
+        self.assertEqual(model.get_children("book"), ("page",))
+        self.assertEqual(model.get_children("page"), ())
+
+    def test_relaxng_with_prefixes(self):
+        path = os.path.join(exalt.get_plugin_path(), "rng", "xslt10.rng")
+        model = contentmodel.from_relaxng(path)
+
+        self.assertIn("template", model.get_children("xsl:stylesheet"))
+        self.assertEqual(model.get_attributes("xsl:output")["method"],
+                         ("html", "text", "xml"))
+
+    def test_xml_schema(self):
+        model = contentmodel.from_xml_schema(self.schema("note.xsd"))
+
+        self.assertEqual(model.get_children("note"),
+                         ("emphasis", "text", "to"))
+        self.assertEqual(model.get_attributes("note"),
+                         {"priority": ("high", "low")})
+
+
+class TestExaltCompletions(TestCase):
+    def get_context(self, text):
+        return completions.get_context(text, 0)
+
+    def test_element_context(self):
+        context = self.get_context("<a><b")
+
+        self.assertEqual(context.kind, completions.ELEMENT)
+        self.assertEqual(context.start, 3)
+
+    def test_attribute_context(self):
+        context = self.get_context('<a><b x="1" y')
+
+        self.assertEqual(context.kind, completions.ATTRIBUTE)
+        self.assertEqual(context.element, "b")
+
+    def test_attribute_value_context(self):
+        context = self.get_context('<a><b x="1" y=\'')
+
+        self.assertEqual(context.kind, completions.VALUE)
+        self.assertEqual(context.attribute, "y")
+
+    def test_no_context_in_end_tag(self):
+        self.assertIsNone(self.get_context("<a></a"))
+
+    def test_get_parent(self):
+        self.assertEqual(completions.get_parent(
+            '<a><b x="/>"><c/><!-- <d> --><e></e>'
+        ), "b")
+
+    def test_get_parent_of_cursor_after_elements(self):
+        self.assertIsNone(completions.get_parent("<a><b></b></a>"))
+        self.assertIsNone(completions.get_parent("</x></y><b></b>"))
+        self.assertEqual(completions.get_parent("</x><b><c></c>"), "b")
+
+
+class TestExaltSchemaAssociations(TestCase):
+    RULES = [
+        {"root": "topic", "glob": "*.dita", "schema": "/topic.rng"},
+        {"namespace": "http://docbook.org/ns/docbook",
+         "schema": "/docbook.rng"},
+        {"public_id": "-//OASIS//DTD DITA Map//EN", "schema": "/map.dtd"},
+        {"glob": "*/maven/pom.xml", "schema": "/pom.xsd"}
+    ]
+
+    def setUp(self):
+        self.index = associations.AssociationIndex(self.RULES)
+
+    def find(self, path, text):
+        return self.index.find(path, associations.scan(text))
+
+    def test_scan_prolog(self):
+        prolog = associations.scan(
+            '<?xml version="1.0"?>\n'
+            '<!-- Comment -->\n'
+            '<!DOCTYPE map PUBLIC "-//OASIS//DTD DITA Map//EN" "map.dtd">\n'
+            '<d:map xmlns:d="urn:d" xmlns="urn:x">'
+        )
+
+        self.assertEqual(prolog.public_id, "-//OASIS//DTD DITA Map//EN")
+        self.assertEqual(prolog.root, "map")
+        self.assertEqual(prolog.namespace, "urn:d")
+
+    def test_find_by_namespace(self):
+        association = self.find(
+            None, '<book xmlns="http://docbook.org/ns/docbook">'
+        )
+
+        self.assertEqual(association.schema, "/docbook.rng")
+        self.assertEqual(association.schema_type, namespaces.RELAXNG)
+
+    def test_find_by_public_id(self):
+        association = self.find(
+            None, '<!DOCTYPE map PUBLIC "-//OASIS//DTD DITA Map//EN" ""><map>'
+        )
+
+        self.assertEqual(association.schema_type, "dtd")
+
+    def test_all_conditions_must_match(self):
+        self.assertIsNotNone(self.find("/a/b.dita", "<topic>"))
+        self.assertIsNone(self.find("/a/b.xml", "<topic>"))
+
+    def test_find_by_glob(self):
+        self.assertIsNotNone(self.find("/a/maven/pom.xml", "<project>"))
+        self.assertIsNone(self.find("/a/pom.xml", "<project>"))
+
+    def test_skip_rules_without_schema(self):
+        invalid = [{"root": "book"}, {"root": "book", "schema": ""}, "x"]
+        index = associations.AssociationIndex(invalid + self.RULES)
+
+        self.assertEqual(index.invalid, invalid)
+        self.assertIsNone(index.find(None, associations.scan("<book>")))
+        self.assertEqual(
+            index.find("/a/b.dita", associations.scan("<topic>")).schema,
+            "/topic.rng"
+        )
@@ -1,4 +1,5 @@
 import os
+import bisect
 import sublime
 
 import Exalt.constants as constants
@@ -6,15 +7,38 @@ import Exalt.messages as messages
 import Exalt.settings as settings
 import Exalt.exalt as exalt
 
+# The number of characters on either side of an error on a long line we look
+# at to find the token the error is about.
+TOKEN_CONTEXT = 256
+
+# The number of characters on either side of an error in error excerpts.
+EXCERPT_CONTEXT = 40
+
 
 def set_status(view, message):
     view.set_status(constants.PLUGIN_NAME, message)
 
 
+def show_mode(view, large):
+    """Show in the status bar whether Exalt treats the document in the view
+    as a large document."""
+    if large:
+        view.set_status(constants.MODE_STATUS_KEY,
+                        messages.LARGE_DOCUMENT_MODE)
+    else:
+        view.erase_status(constants.MODE_STATUS_KEY)
+
+
 def get_content(view):
     return view.substr(sublime.Region(0, view.size()))
 
 
+def is_blank(view):
+    """Check whether the view contains nothing but whitespace without copying
+    its contents."""
+    return view.find(r"\S", 0).begin() == -1
+
+
 def erase_status(view):
     if view.get_status(constants.PLUGIN_NAME) == messages.VALID_MARKUP:
         view.erase_status(constants.PLUGIN_NAME)
@@ -62,39 +86,258 @@ def is_xslt(view):
     return get_syntax(view) in ["XSL", "XSLT"]
 
 
+class ErrorIndex:
+    """A sorted index of all the errors in a view.
+
+    Each error is a (point, message) record. The points and the messages are
+    kept in two parallel lists sorted by point so that we can find the errors
+    near a point with a binary search.
+
+    If syntax is True, the errors are well-formedness errors. Otherwise they
+    come from validating the document against its schema."""
+
+    def __init__(self, records, syntax=False):
+        records = sorted(records, key=lambda record: record[0])
+        self.points = [point for point, _ in records]
+        self.messages = [message for _, message in records]
+        self.syntax = syntax
+        self.highlighted = None
+        self.current = None
+
+    def __len__(self):
+        return len(self.points)
+
+    def between(self, begin, end):
+        """Get the (point, message) records between begin and end."""
+        i = bisect.bisect_left(self.points, begin)
+        j = bisect.bisect_right(self.points, end)
+        return list(zip(self.points[i:j], self.messages[i:j]))
+
+    def is_current(self, point):
+        return self.current is not None and self.points[self.current] == point
+
+    def next(self, point):
+        """Get the position of the first error after point.
+
+        Wraps around to the first error in the document."""
+        if self.is_current(point):
+            i = self.current + 1
+        else:
+            i = bisect.bisect_right(self.points, point)
+
+        return i if i < len(self.points) else 0
+
+    def previous(self, point):
+        """Get the position of the last error before point.
+
+        Wraps around to the last error in the document."""
+        if self.is_current(point):
+            i = self.current - 1
+        else:
+            i = bisect.bisect_left(self.points, point) - 1
+
+        return i if i >= 0 else len(self.points) - 1
+
+
+def get_error_index(view):
+    return exalt.error_indexes.get(view.id())
+
+
+def has_validation_errors(view):
+    """Check whether the view has errors from validating the document
+    against its schema."""
+    index = get_error_index(view)
+    return bool(index) and not index.syntax
+
+
+def is_long_line(view, point):
+    """Check whether the line point is on is too long to highlight in
+    full."""
+    return view.line(point).size() > \
+        exalt.get_setting(settings.LONG_LINE_LENGTH, 1000)
+
+
 def get_error_region(view, point):
-    """Get the line the error's on."""
-    line = view.line(point)
-    return sublime.Region(line.begin(), line.end())
+    """Get the line the error's on, or just the markup token at the error if
+    the line is long.
+
+    Highlighting a line of a minified document would highlight the whole
+    document, which makes redrawing the view slow."""
+    if not is_long_line(view, point):
+        return view.line(point)
+
+    begin = max(0, point - TOKEN_CONTEXT)
+    end = min(view.size(), point + TOKEN_CONTEXT)
+    start, stop = get_token_bounds(view.substr(sublime.Region(begin, end)),
+                                   point - begin)
+
+    return sublime.Region(begin + start, begin + stop)
 
 
-def get_error_point(view, error):
+def get_token_bounds(text, i):
+    """Get the (start, stop) bounds of the tag or the run of text between
+    tags at index i of text.
+
+    libxml2 often reports the column right after the token it has a problem
+    with, so a tag that ends right before i wins over a tag that begins at
+    i."""
+    ends = (i, i + 1) if i > 0 and text[i - 1] == ">" else (i + 1,)
+
+    for end in ends:
+        lt = text.rfind("<", 0, end)
+        gt = text.find(">", lt) if lt != -1 else -1
+
+        if gt != -1 and gt >= i - 1:
+            return lt, gt + 1
+
+    start = text.rfind(">", 0, i) + 1
+    stop = text.find("<", i)
+    stop = len(text) if stop == -1 else stop
+
+    if start >= stop:
+        return i, min(len(text), i + 1)
+
+    return start, stop
+
+
+def get_error_point(view, error, locate=None):
     """Get the error text point.
 
     lxml uses 1-based line and column numbers but ST wants them
-    0-based, so subtract 1 from both."""
-    return view.text_point(error.line - 1, error.column - 1)
+    0-based, so subtract 1 from both. Validation errors have no column,
+    though, so we use the beginning of the line for those, unless the line is
+    long and the locate function can tell where the element the error is
+    about begins."""
+    point = view.text_point(error.line - 1, max(0, error.column - 1))
 
+    if locate is not None and error.column <= 0 and \
+       is_long_line(view, point):
+        located = locate(error)
 
-def show_error(view, message, error=None):
-    """Show the given error message in the Sublime Text status bar and
-    highlight the error region if given."""
+        if located is not None:
+            return located
+
+    return point
+
+
+def get_error_records(view, errors, describe=None, locate=None):
+    """Get a (point, message) record for every lxml error in errors."""
+    describe = describe or (lambda error: error.message)
+    return [(get_error_point(view, error, locate), describe(error))
+            for error in errors]
+
+
+def get_error_excerpt(view, point):
+    """Get a one-line excerpt of the text around point."""
+    begin = max(0, point - EXCERPT_CONTEXT)
+    end = min(view.size(), point + EXCERPT_CONTEXT)
+    excerpt = " ".join(view.substr(sublime.Region(begin, end)).split())
+
+    return "%s%s%s" % ("\u2026" if begin > 0 else "",
+                       excerpt,
+                       "\u2026" if end < view.size() else "")
+
+
+def highlight_errors(view):
+    """Highlight the errors in and around the visible part of the view.
+
+    Documents can have thousands of errors, so we only draw the regions of
+    the errors that are at most one screenful away from the viewport."""
+    index = get_error_index(view)
+
+    if not index:
+        return
+
+    visible = view.visible_region()
+
+    if index.highlighted is not None and \
+       index.highlighted.contains(visible):
+        return
+
+    margin = visible.size()
+    begin = max(0, visible.begin() - margin)
+    end = visible.end() + margin
+
+    regions = [get_error_region(view, point)
+               for point, _ in index.between(begin, end)]
+
+    index.highlighted = sublime.Region(begin, end)
+
+    view.add_regions(constants.PLUGIN_NAME,
+                     regions,
+                     "variable.parameter",
+                     "dot",
+                     constants.SUBLIME_REGION_FLAGS)
+
+
+def clear_errors(view):
+    """Forget the errors in the view and remove their highlight regions."""
+    exalt.error_indexes.pop(view.id(), None)
+    view.erase_regions(constants.PLUGIN_NAME)
+
+
+def go_to_point(view, point):
+    """Move the cursor to the given point and center the view on it."""
+    view.sel().clear()
+    view.sel().add(sublime.Region(point))
+    view.show_at_center(point)
+
+
+def go_to_error(view, position):
+    """Move the cursor to the error at the given position in the error
+    index."""
+    index = get_error_index(view)
+
+    if not index:
+        return
+
+    point = index.points[position]
+    index.current = position
+
+    go_to_point(view, point)
+
+    highlight_errors(view)
+    set_status(view, messages.ERROR_POSITION % (position + 1,
+                                                len(index),
+                                                index.messages[position]))
+
+
+def show_errors(view, message, errors, describe=None, locate=None,
+                syntax=False):
+    """Show the given error message in the Sublime Text status bar and index
+    all the given errors.
+
+    The describe function gets the message of an individual lxml error and
+    defaults to the message of the error itself. The locate function gets
+    the point of the element an error without a column is about. If syntax
+    is True, the errors are well-formedness errors."""
+    show_error_records(view, message,
+                       get_error_records(view, errors, describe, locate),
+                       syntax)
+
+
+def show_error_records(view, message, records, syntax=False):
+    """Show the given error message in the Sublime Text status bar and index
+    the given (point, message) records."""
     set_status(view, str(message))
 
-    if error is not None:
-        point = get_error_point(view, error)
-        region = get_error_region(view, point)
+    index = ErrorIndex(records, syntax)
+    exalt.error_indexes[view.id()] = index
+
+    view.erase_regions(constants.PLUGIN_NAME)
+    highlight_errors(view)
 
-        exalt.error_point = point
+    scroll = bool(exalt.get_settings()
+                  .get(settings.AUTO_SCROLL_TO_ERROR, False))
 
-        view.add_regions(constants.PLUGIN_NAME,
-                         [region],
-                         "variable.parameter",
-                         "dot",
-                         constants.SUBLIME_REGION_FLAGS)
+    if scroll and index:
+        view.show_at_center(index.points[0])
 
-        scroll = bool(exalt.get_settings()
-                      .get(settings.AUTO_SCROLL_TO_ERROR, False))
 
-        if scroll:
-            view.show_at_center(point)
+def show_error(view, message, error=None):
+    """Show the given error message in the Sublime Text status bar and
+    highlight the error region if given."""
+    if error is None:
+        set_status(view, str(message))
+    else:
+        show_errors(view, message, [error])